@@ -1,17 +1,321 @@
+import gzip
+import heapq
+import html
+import io
+import json
+from array import array
 import os
-import shelve
+import re
+import shutil
+import sqlite3
 import time
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
 from queue import Empty, Queue
-from threading import RLock
-from urllib.parse import urljoin, urlparse
-from io import StringIO
+from threading import Condition, Event, RLock, Thread, current_thread
+from functools import lru_cache
+from itertools import islice
+from urllib.parse import quote, urljoin, urlsplit
 from lxml import etree
+import requests
+from requests.adapters import HTTPAdapter
+import urllib3
 from scraper import is_valid
 from utils.download import download
 from utils import get_logger, get_urlhash, normalize
 from crawler.robot_parser import CustomRobotsParser
 import pickle
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+try:
+    from fastrlock.rlock import RLock as FastRLock
+except ImportError:
+    FastRLock = RLock
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# simhash band buckets at least this long are also kept as numpy arrays and
+# compared in one vectorized pass
+_SIMHASH_VECTORIZE_MIN = 64
+
+
+def _popcounts(values):
+    """
+    Count the set bits of each element of a uint64 numpy array.
+    """
+    if hasattr(numpy, 'bitwise_count'):  # numpy 2.0+
+        return numpy.bitwise_count(values)
+    return numpy.unpackbits(values.view(numpy.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+def _zero_counts(size):
+    """
+    Make a column of size int64 zeros, a numpy array when numpy is installed.
+    """
+    if numpy is not None:
+        return numpy.zeros(size, dtype=numpy.int64)
+    return array('q', bytes(8 * size))
+
+
+def _pack_bucket(bucket, packed):
+    """
+    Copy the simhashes appended to a band bucket into its numpy buffer.
+
+    The buffer doubles when full, so a growing bucket is copied O(log n)
+    times instead of being repacked whole every _SIMHASH_VECTORIZE_MIN
+    appends. Only the part past the previous count is written, so lookups
+    still reading that prefix are unaffected.
+
+    Parameters:
+        bucket (list): simhashes of the bucket
+        packed (tuple): previous (buffer, count) of the bucket, or None
+
+    Returns:
+        tuple: (uint64 buffer, number of simhashes in it)
+    """
+    buffer, count = packed if packed is not None else (numpy.empty(0, dtype=numpy.uint64), 0)
+    size = len(bucket)
+    if size > len(buffer):
+        grown = numpy.empty(max(size, 2 * len(buffer)), dtype=numpy.uint64)
+        grown[:count] = buffer[:count]
+        buffer = grown
+    buffer[count:size] = bucket[count:size]
+    return buffer, size
+
+# sitemap entries are found by their <loc> in any namespace; a <loc> inside
+# a <sitemap> rather than a <url> points to a child sitemap, one inside
+# anything else (image and video extensions) is skipped
+_SITEMAP_LOC_TAG = "{*}loc"
+_SITEMAP_ENTRY_TAGS = frozenset(("url", "sitemap"))
+# sitemap.xml.gz files are served gzipped without a Content-Encoding
+_GZIP_MAGIC = b"\x1f\x8b"
+# plain sitemaps (an unprefixed <urlset> or <sitemapindex> root, no DTD)
+# are scanned for their <loc> values as bytes instead of parsed; the root
+# has to be in the first bytes buffered
+_SITEMAP_HEAD_BYTES = 4096
+_SITEMAP_ROOT_RE = re.compile(rb"<(\w+:)?(urlset|sitemapindex)\b")
+_SITEMAP_LOC_RE = re.compile(rb"<loc>\s*([^<\s][^<]*?)\s*</loc>")
+# only blocks containing CDATA pay for the alternation: (escaped, CDATA) pairs
+_SITEMAP_CDATA_LOC_RE = re.compile(
+    rb"<loc>\s*(?:([^<\s][^<]*?)|<!\[CDATA\[\s*(.*?)\s*\]\]>)\s*</loc>", re.DOTALL)
+_CDATA = b"<![CDATA["
+_SITEMAP_READ_BYTES = 1 << 16
+
+# backups made of plain containers are written as JSON when orjson is
+# installed, which is several times faster than pickle. The files keep
+# their .pkl names; _load_backup tells the formats apart by content.
+# name -> (to JSON-compatible value, back from it)
+_JSON_BACKUPS = {
+    'last_request_time': (dict, dict),
+    'bad_urls': (list, set),
+    'errors': (list, set),
+    'word_count': (dict, Counter),
+    'max_words': (list, tuple),
+    # a list of pairs, as JSON object keys can't be ints
+    'simhashes': (lambda v: list(v.items()), dict),
+}
+
+
+@lru_cache(maxsize=262144)
+def _parse(url):
+    """
+    Normalize and parse url once into the parts the frontier needs,
+    memoizing the result, so a url seen again costs a single cache lookup.
+    urlsplit skips the ;params split that urlparse does, and keeps them in
+    the path robots.txt rules are matched against.
+
+    Parameters:
+        url (str): url to parse
+
+    Returns:
+        tuple: (normalized url, netloc, path, hostname, normalized url without its fragment)
+    """
+    url = normalize(url)
+    parsed = urlsplit(url)
+    return url, parsed.netloc, parsed.path, parsed.hostname, url.partition("#")[0]
+
+
+@lru_cache(maxsize=262144)
+def _url_key(url):
+    """
+    Hash url for the url index, memoizing the hex digest the save file is
+    keyed by together with the raw digest _url_index is keyed by.
+
+    Parameters:
+        url (str): normalized url without its fragment
+
+    Returns:
+        tuple: (urlhash, 32-byte digest)
+    """
+    urlhash = get_urlhash(url)
+    return urlhash, bytes.fromhex(urlhash)
+
+
+def _scan_sitemap_locs(stream, logger=None):
+    """
+    Scan a plain sitemap for the values of its <loc> elements.
+
+    The sitemap is read in blocks, keeping only an unfinished <loc> at the
+    end of a block for the next one. Entities such as &amp; are unescaped,
+    CDATA sections are taken as they are. A value that is not valid UTF-8
+    is skipped rather than yielded with bytes missing.
+
+    Parameters:
+        stream (file): the sitemap's body
+        logger (logging.Logger, optional): logger for skipped values. Defaults to None.
+
+    Yields:
+        str: the <loc> values, in document order
+    """
+    buffer = b""
+    for block in iter(lambda: stream.read(_SITEMAP_READ_BYTES), b""):
+        buffer += block
+        if _CDATA in buffer:
+            # CDATA is literal; escaping its '&' lets it share the unescaping below
+            locs = [escaped or cdata.replace(b"&", b"&amp;")
+                    for escaped, cdata in _SITEMAP_CDATA_LOC_RE.findall(buffer) if escaped or cdata]
+        else:
+            locs = _SITEMAP_LOC_RE.findall(buffer)
+        for loc in locs:
+            try:
+                loc = loc.decode('utf-8')
+            except UnicodeDecodeError:
+                if logger:
+                    logger.info(f"Skipped sitemap <loc> that is not UTF-8: {loc[:200]!r}.")
+                continue
+            if '&' in loc:
+                # query strings make &amp; the only entity in nearly every sitemap
+                loc = (loc.replace('&amp;', '&') if '&' not in loc.replace('&amp;', '')
+                       else html.unescape(loc))
+            yield loc
+        close = buffer.rfind(b"</loc>")
+        end = close + len(b"</loc>") if close >= 0 else 0
+        # everything before an unfinished <loc> (or the start of one) is done
+        start = buffer.rfind(b"<loc>", end)
+        buffer = buffer[start:] if start >= 0 else buffer[max(end, len(buffer) - 4):]
+
+
+def _dump_backup(path, value, name=None):
+    """
+    Atomically write value to path, zstd-compressed when zstandard is installed.
+
+    Values of the fields in _JSON_BACKUPS are written as JSON if orjson is
+    installed and pickled otherwise. The backup is written and fsynced to a
+    temp file, then moved over path, so a crash never leaves a truncated backup.
+
+    Parameters:
+        path (str): file to write
+        value (object): object to back up
+        name (str): field the value belongs to
+    """
+    if orjson is not None and name in _JSON_BACKUPS:
+        data = orjson.dumps(_JSON_BACKUPS[name][0](value))
+        write = lambda f: f.write(data)
+    else:
+        write = lambda f: pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(path + '.tmp', 'wb') as f:
+        if zstandard is not None:
+            compressor = zstandard.ZstdCompressor(level=3, threads=-1)
+            with compressor.stream_writer(f, closefd=False) as writer:
+                write(writer)
+        else:
+            write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def _load_backup(path, name=None):
+    """
+    Load a backup written by _dump_backup, compressed or not, JSON or pickle.
+
+    Parameters:
+        path (str): file to read
+        name (str): field the value belongs to
+
+    Returns:
+        object: the loaded value
+    """
+    with open(path, 'rb') as f:
+        compressed = f.read(4) == ZSTD_MAGIC
+        f.seek(0)
+        if compressed:
+            with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+                data = reader.read()
+        else:
+            data = f.read()
+    # pickles start with the PROTO opcode, JSON with a bracket
+    if data[:1] == pickle.PROTO:
+        return pickle.loads(data)
+    value = orjson.loads(data) if orjson is not None else json.loads(data)
+    return _JSON_BACKUPS[name][1](value)
+
+
+def _replay_log(path):
+    """
+    Read the entries of an append log written next to a backup.
+
+    Parameters:
+        path (str): log to read
+
+    Returns:
+        generator: the JSON entry of each line, up to a partial last line from a crash
+    """
+    with open(path, encoding='utf-8') as log:
+        for line in log:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                return
+
+
+def load_results(backups='backup_datastructures', save_file='frontier.db'):
+    """
+    Load the results of a crawl from its save file and backups, read-only,
+    without starting a Frontier. A running crawl may not have committed its
+    last urls or backed up its last words yet.
+
+    Parameters:
+        backups (str): directory of the save file and backups
+        save_file (str): name of the save file
+
+    Returns:
+        dict: completed_urls (set of the downloaded urls), subdomains (dict of
+            hostname -> set of every url found), word_count (Counter) and
+            max_words ((url, word count) of the page with the most words)
+    """
+    save_path = os.path.abspath(os.path.join(backups, save_file))
+    save = sqlite3.connect(f"file:{quote(save_path)}?mode=ro", uri=True)
+    try:
+        rows = save.execute("SELECT url, completed FROM urls").fetchall()
+    finally:
+        save.close()
+    subdomains = defaultdict(set)
+    for url, _ in rows:
+        subdomains[urlsplit(url).hostname].add(url)
+
+    results = {'completed_urls': {url for url, completed in rows if completed},
+               'subdomains': subdomains}
+    for name, default in (('word_count', Counter()), ('max_words', (None, 0))):
+        path = os.path.join(backups, name + '.pkl')
+        results[name] = _load_backup(path, name) if os.path.exists(path) else default
+    # the word counts since the last compaction are only in the log
+    path = os.path.join(backups, 'word_count.log')
+    for log_path in (path + '.old', path):
+        if os.path.exists(log_path):
+            for entry in _replay_log(log_path):
+                results['word_count'].update(entry)
+    return results
 
 
 # TODO: Remove simhashing and modify bad url similarity checks to ensure that no wiki page is downloaded twice
@@ -21,14 +325,28 @@ class Frontier(object):
     Frontier class for frontier set and frontier queue.
 
     Attributes:
-        politeness_delay (float): delay between requests to same domain
-        domains (dict): dict of Queue for each domain cond
+        politeness_delay (float): delay between requests to same domain, unless its robots.txt asks for more
+        max_crawl_delay (float): longest robots.txt Crawl-delay honored
+        domains_to_scrape (dict): array of queued url row numbers for each domain with queued urls
         last_request_time (dict): time of last request to each domain
-        lock (RLock): lock for thread safety
+        lock (RLock): lock for the scheduler (queues, heap, last_request_time, in-flight count),
+            first in the lock order; every other shared structure has its own lock
+        url_available (Condition): condition on lock, notified when a domain is scheduled or a url completes
         logger (Logger): logger instance
         config (Config): configuration instance
-        save (shelve): save file instance
-        subdomains (set): set of subdomains
+        save (sqlite3.Connection): WAL-mode SQLite save file, written only by the background writer
+        subdomains (dict): urls of each subdomain, rebuilt from the save file on load
+        robots_parsers (dict): (parser, fetched_at) for each domain, parser is None if robots.txt could not be fetched
+        robots_ttl (float): seconds a fetched robots.txt parser stays valid
+        robots_negative_ttl (float): seconds before a failed robots.txt fetch is retried
+        robots_max_failures (int): failed robots.txt fetches in a row after which the urls waiting on it are left for the next run
+        fetched_sitemaps (set): sitemap urls that have already been fetched
+        http (requests.Session): keep-alive session for robots.txt and sitemap downloads
+        word_count (Counter): count of every word across downloaded pages, built
+            on demand from a vocabulary and a counts column
+        max_words (tuple): (url, word count) of the page with the most words
+        save_flush_ops (int): number of queued writes that triggers a commit
+        save_flush_interval (float): max seconds a queued write waits for its commit
     """
     def __init__(self, config, restart):
         """
@@ -39,127 +357,955 @@ class Frontier(object):
             restart (bool): whether to restart from seed
         """
         self.politeness_delay = config.time_delay
-        self.domains_to_scrape = defaultdict(Queue) # frontier queue for each domain
+        self.max_crawl_delay = 60 # a larger robots.txt Crawl-delay is capped to this many seconds
+        # frontier queue for each domain, as row numbers into the url columns
+        # (4 bytes per queued url instead of a (url, depth) tuple); a queue is
+        # consumed from _queue_heads[domain] on and compacted now and then
+        self.domains_to_scrape = {}
+        self._queue_heads = {} # domain -> position of the next url in its queue
         self.last_request_time = {} # time of last request to each domain
-        self.lock = RLock() # general lock for all other shared resources
-        self.robots_parsers_lock = RLock() # lock for robots_parsers
-        self.simhash_lock = RLock() # lock for simhash dictionary
-        self.sitemaps_lock = RLock() # lock for sitemaps
+        self.lock = RLock() # scheduler lock: queues, _ready, last_request_time and _in_flight
+        self.url_available = Condition(self.lock) # wakes workers waiting in get_tbd_url
+        self._earliest_changed = Condition(self.lock) # wakes only the worker sleeping until the earliest domain is ready
+        self._ready = [] # heap of (next allowed request time, domain) for every domain with queued urls
+        self._in_flight = 0 # urls handed out by get_tbd_url but not yet marked complete
+        self._timed_waiter = False # whether a worker is already sleeping until the earliest domain is ready
+        # fastrlock can't back a Condition, so only the locks below use it.
+        # When holding several locks, always acquire them in the order
+        # backup_lock -> lock -> robots_parsers_lock -> sitemaps_lock -> simhash_lock
+        #   -> save_lock -> subdomains_lock -> words_lock -> bad_urls_lock
+        self.backup_lock = FastRLock() # held by pickle_fields for a whole backup, taken before all others
+        self.save_lock = FastRLock() # lock for the url columns
+        self.subdomains_lock = FastRLock() # lock for subdomains
+        self.words_lock = FastRLock() # lock for word_count and max_words
+        self.bad_urls_lock = FastRLock() # lock for low_data_urls and error_urls
+        self.robots_parsers_lock = FastRLock() # lock for robots_parsers and _robots_in_flight
+        self._robots_in_flight = {} # domain -> Future of the robots.txt fetch under way
+        self._robots_failures = {} # domain -> robots.txt fetches failed in a row
+        self.simhash_lock = FastRLock() # lock for simhash dictionary
+        self.sitemaps_lock = FastRLock() # lock for sitemaps
+        self.fetched_sitemaps = set() # sitemap urls already fetched (or being fetched)
+        self.sitemap_domains = set() # domains whose robots.txt sitemaps have been claimed for processing
+        self.sitemap_workers = 8 # child sitemaps fetched at once, across all sitemap indexes
+        self._sitemap_executor = ThreadPoolExecutor(max_workers=self.sitemap_workers)
+        self.sitemap_chunk_size = 1000 # sitemap urls added per add_urls call
+        self.robots_workers = 8 # robots.txt files of new domains fetched at once per add_urls batch
+        self._robots_executor = ThreadPoolExecutor(max_workers=self.robots_workers)
+        # robots.txt and sitemap downloads share one session, so sitemaps of a
+        # host reuse the connection (and TLS session) of its robots.txt
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=100, pool_maxsize=100)
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
         self.logger = get_logger("FRONTIER")
         self.config = config
-        #self.simhashes = {}
-        self.low_data_urls = set()
-        self.error_urls = set()
+        # frozensets, replaced rather than mutated, so get_bad_urls can hand them out without copying
+        self.low_data_urls = frozenset()
+        self.error_urls = frozenset()
         self.links_processed = 0
         self.backup_interval = 7200  # Backup interval in seconds (e.g., 1200 seconds = 20 minutes)
         self.backups = './backup_datastructures'  # Folder to store backups
         self.last_backup_time = time.time()  # Initialize last backup time
+        self.save_flush_ops = config.save_flush_ops  # Commit the save file after this many queued writes
+        self.save_flush_interval = config.save_flush_interval  # ... or after this many seconds, whichever comes first
+        self.save_queue_max = 10000  # Workers block on new writes while this many are waiting for the writer
+        self.robots_ttl = config.robots_ttl  # Refetch robots.txt after this many seconds
+        self.robots_negative_ttl = 600  # Retry failed robots.txt fetches after 10 minutes
+        self.robots_max_failures = 6  # Give up on a domain's robots.txt for this run after an hour of failures
+        self.robots_max_bytes = 500 * 1024  # Like Googlebot, ignore robots.txt past 500 KiB
+        self.simhash_bands = 4  # Split simhashes into 4 bands of 16 bits for near duplicate lookup
+        self.simhash_max_distance = 3  # Pages differing in at most 3 bits are near duplicates
+        self.log_compact_every = 6  # Snapshot simhashes and word_count, truncating their logs, every 6th backup
+        self._backups_since_compaction = 0
+        # backups changed since they were last written; every one is written
+        # once, then only when changed (last_request_time changes constantly)
+        self._dirty_backups = {'bad_urls', 'errors', 'robots_parsers', 'max_words'}
 
-        self.handle_shelves(restart)
+        self.handle_save_file(restart)
+        # sitemaps of the domains whose robots.txt was fetched were processed by the last run
+        self.sitemap_domains.update(
+            domain for domain, (parser, _) in self.robots_parsers.items() if parser is not None)
+        self._stop_backups = Event()
+        self._closed = False # set by close_save, which runs only once
+        self._backup_thread = Thread(target=self._backup_loop, daemon=True)
+        self._backup_thread.start()
 
         if restart:
-            for url in self.config.seed_urls:
-                self.add_url(url, 0)
+            self._bootstrap_seeds(self.config.seed_urls)
         else:
             self._parse_save_file()
-            if not self.save:
-                for url in self.config.seed_urls:
-                    self.add_url(url, 0)
+            if not self._url_index:
+                self._bootstrap_seeds(self.config.seed_urls)
+
+    def _bootstrap_seeds(self, seed_urls):
+        """
+        Add seed urls, fetching the robots.txt and sitemaps of all seed domains concurrently.
+
+        Parameters:
+            seed_urls (list): urls to start crawling from
+        """
+        domains = list({_parse(url)[1] for url in seed_urls})
+        with ThreadPoolExecutor(max_workers=self.config.threads_count) as executor:
+            parsers = list(executor.map(self.download_robots_txt_parser_for_domain, domains))
+            fetched_at = time.time()
+            with self.robots_parsers_lock:
+                for domain, parser in zip(domains, parsers):
+                    self.robots_parsers[domain] = (parser, fetched_at)
+                self._dirty_backups.add('robots_parsers')
+            # the sitemaps of the seed domains are processed below; a domain whose
+            # robots.txt failed is left for add_urls to claim once it is fetched
+            with self.sitemaps_lock:
+                self.sitemap_domains.update(
+                    domain for domain, parser in zip(domains, parsers) if parser is not None)
+            self.add_urls(seed_urls, 0)
+
+            sitemap_urls = [sitemap_url for parser in parsers if parser is not None
+                            for sitemap_url in parser.get_sitemaps()]
+            # list() waits for every sitemap and re-raises their errors
+            list(executor.map(self.add_sitemap_urls, sitemap_urls, [0] * len(sitemap_urls)))
 
     def _parse_save_file(self):
         """
         Parse save file and add urls to frontier.
+
+        The urls passed is_valid and robots.txt when they were first added,
+        so they are queued directly, one bulk extend per domain. The urls
+        still to download are found in the in-memory completed bitmap.
         """
         with self.lock:
-            total_count = len(self.save)
+            total_count = len(self._url_index)
             tbd_count = 0
-            for url, depth, completed in self.save.values():
-                if not completed and is_valid(url):
-                    domain = urlparse(url).hostname
-                    self.domains_to_scrape[domain].put((url, depth))
-                    tbd_count += 1
+            pending = defaultdict(list)
+            completed = self._completed
+            for index, url in enumerate(self._urls):
+                if not completed[index >> 3] & (1 << (index & 7)):
+                    pending[_parse(url)[1]].append(index)
+            for domain, entries in pending.items():
+                self._enqueue_all(domain, entries)
+                tbd_count += len(entries)
             self.logger.info(
                 f"Found {tbd_count} urls to be downloaded from {total_count} "
                 f"total urls discovered.")
     
+    def _enqueue_all(self, domain, entries):
+        """
+        Queue several urls for one domain, scheduling the domain if it had nothing queued.
+
+        Parameters:
+            domain (str): domain of the urls
+            entries (iterable): row numbers of the urls in the url columns
+        """
+        with self.url_available:
+            url_queue = self.domains_to_scrape.get(domain)
+            if url_queue is None:
+                ready_time = max(self.last_request_time.get(domain, 0) + self._domain_delay(domain),
+                                 self._robots_retry_time(domain))
+                heapq.heappush(self._ready, (ready_time, domain))
+                # waiters only need waking if this domain is now the earliest ready:
+                # the worker sleeping until the old earliest time re-checks, or,
+                # if none is, a single idle worker takes the turn
+                if self._ready[0][1] == domain:
+                    if self._timed_waiter:
+                        self._earliest_changed.notify()
+                    else:
+                        self.url_available.notify()
+                url_queue = self.domains_to_scrape[domain] = array('I')
+                self._queue_heads[domain] = 0
+            url_queue.extend(entries)
+
     def get_tbd_url(self):
         """
         Get next url to be downloaded.
 
+        Blocks until the domain with the earliest allowed request time is ready.
+        Returns (None, None) once no urls are queued and none are in flight.
+
+        Urls are checked against robots.txt once more before they are handed
+        out. Urls queued while their domain's robots.txt could not be fetched
+        wait in the queue until it can be (see _robots_retry_time), and are
+        skipped if it turns out to disallow them.
+
         Returns:
             str: next url to be downloaded
         """
-        with self.lock:
-            self.links_processed += 1
-            self.pickle_fields()
-            while len(self.domains_to_scrape) > 0:
-                for domain, url_queue in list(self.domains_to_scrape.items()):
-                    if domain in self.last_request_time:
-                        last_request_time = self.last_request_time[domain]
-                    else:
-                        last_request_time = 0
-                    time_since_last_request = time.time() - last_request_time
+        while True:
+            url, depth = self._next_url()
+            if url is None:
+                return None, None
+            _, domain, path, _, _ = _parse(url)
+            parser = self.get_robots_txt_parser(domain)
+            if parser is None:
+                if self._robots_failures.get(domain, 0) >= self.robots_max_failures:
+                    # the domain's urls are left incomplete in the save file, so
+                    # the next run retries them; each one waiting out another
+                    # negative TTL would only hold up the end of this run
+                    dropped = self._drop_domain(domain)
+                    self.logger.error(
+                        f"Giving up on {url} and {dropped} more queued urls of {domain} "
+                        f"for this run, its robots.txt failed {self.robots_max_failures} "
+                        f"times in a row.")
+                    self.release_url(url)
+                else:
+                    self.release_url(url, requeue=True)
+                continue
+            if not parser.can_fetch(path):
+                self.logger.debug("URL path of %s not allowed by robots.txt.", url)
+                self.mark_url_complete(url, depth)
+                continue
+            return url, depth
+
+    def _next_url(self):
+        """
+        Take the next url off the scheduler, counting it as in flight.
+
+        Blocks until the domain with the earliest allowed request time is ready.
 
-                    if time_since_last_request >= self.politeness_delay:
+        Returns:
+            tuple: (url, depth), or (None, None) once no urls are queued and none are in flight
+        """
+        with self.url_available:
+            while True:
+                if not self._ready:
+                    if self._in_flight == 0:
+                        self.url_available.notify_all()
+                        return None, None
+                    # in-flight urls may still add more work
+                    self.url_available.wait()
+                    continue
+
+                ready_time, domain = self._ready[0]
+                # one clock read per pass, reused below as the request time
+                now = time.time()
+                wait_time = ready_time - now
+                if wait_time > 0:
+                    # one worker sleeps until the earliest domain is ready, the
+                    # rest wait to be handed the turn, so they don't all wake
+                    # at once to race for a single url
+                    if self._timed_waiter:
+                        self.url_available.wait()
+                    else:
+                        self._timed_waiter = True
                         try:
-                            url, depth = url_queue.get(block=False)
-                            self.last_request_time[domain] = time.time()
-                            return url, depth
-                        except Empty:
-                            del self.domains_to_scrape[domain]
-                time.sleep(self.politeness_delay)
-            
-            return None, None
+                            self._earliest_changed.wait(wait_time)
+                        finally:
+                            self._timed_waiter = False
+                    continue
+                # a sitemap download may have reserved the domain's turn since
+                # it was scheduled (see _wait_for_turn), a refetched robots.txt
+                # raised its Crawl-delay, or its robots.txt fetch failed again;
+                # move it back in line
+                # instead of requesting from the host too soon
+                earliest = max(self.last_request_time.get(domain, 0) + self._domain_delay(domain),
+                               self._robots_retry_time(domain))
+                if earliest > now:
+                    heapq.heapreplace(self._ready, (earliest, domain))
+                    continue
+
+                url_queue = self.domains_to_scrape.get(domain)
+                head = self._queue_heads.get(domain, 0)
+                if url_queue is None or head >= len(url_queue):
+                    # the domain's queue was emptied or replaced behind the scheduler's back
+                    heapq.heappop(self._ready)
+                    self.domains_to_scrape.pop(domain, None)
+                    self._queue_heads.pop(domain, None)
+                    continue
+                index = url_queue[head]
+                head += 1
+                # list and array reads are atomic, no need for save_lock
+                url, depth = self._urls[index], self._depths[index]
+                self.last_request_time[domain] = now
+                if head == len(url_queue):
+                    heapq.heappop(self._ready)
+                    del self.domains_to_scrape[domain]
+                    del self._queue_heads[domain]
+                else:
+                    if head >= 4096 and head * 2 >= len(url_queue):
+                        # drop the handed out half at once, a shift per url would be quadratic
+                        del url_queue[:head]
+                        head = 0
+                    self._queue_heads[domain] = head
+                    # reschedule the domain in place, a single sift instead of a pop and a push
+                    heapq.heapreplace(self._ready, (now + self._domain_delay(domain), domain))
+                self._in_flight += 1
+                # counts urls handed out, not calls that came back empty
+                self.links_processed += 1
+                if self._ready and (not self._timed_waiter or self._ready[0][0] <= now):
+                    # hand the turn to a waiting worker, unless one already
+                    # sleeps until the next domain is ready and would only
+                    # be joined by another that goes straight back to sleep
+                    self.url_available.notify()
+                return url, depth
     
+    def _drop_domain(self, domain):
+        """
+        Unschedule a domain, dropping its queued urls without completing them.
+
+        Parameters:
+            domain (str): domain to drop
+
+        Returns:
+            int: number of urls dropped
+        """
+        with self.url_available:
+            url_queue = self.domains_to_scrape.pop(domain, None)
+            head = self._queue_heads.pop(domain, 0)
+            if url_queue is None:
+                return 0
+            self._ready = [entry for entry in self._ready if entry[1] != domain]
+            heapq.heapify(self._ready)
+            # the worker sleeping until the earliest domain may have been waiting on this one
+            if self._timed_waiter:
+                self._earliest_changed.notify()
+            return len(url_queue) - head
+
+    def _domain_delay(self, domain):
+        """
+        Get the delay between two requests to domain.
+
+        A domain whose robots.txt asks for a longer Crawl-delay is simply
+        scheduled further out on the heap, so it never holds up the others.
+
+        Parameters:
+            domain (str): domain to get the delay of
+
+        Returns:
+            float: politeness_delay, or the domain's Crawl-delay if larger (up to max_crawl_delay)
+        """
+        cached = self.robots_parsers.get(domain)
+        crawl_delay = cached[0].crawl_delay if cached and cached[0] is not None else None
+        if crawl_delay is None:
+            return self.politeness_delay
+        return max(self.politeness_delay, min(crawl_delay, self.max_crawl_delay))
+
+    def _robots_retry_time(self, domain):
+        """
+        Get the time a failed robots.txt fetch of domain may be retried.
+
+        The urls queued for a domain whose robots.txt could not be fetched
+        wait on the heap until then, instead of being requested without
+        knowing its rules or dropped.
+
+        Parameters:
+            domain (str): domain to check
+
+        Returns:
+            float: when the robots.txt fetch may be retried, or 0 if it did not fail
+        """
+        cached = self.robots_parsers.get(domain)
+        if cached is None or cached[0] is not None:
+            return 0
+        return cached[1] + self.robots_negative_ttl
+
     def add_url(self, url, depth, scraped=False):
         """
         Add url to frontier.
 
         Parameters:
-            url (str): url to add to fron, tier
+            url (str): url to add to frontier
             depth (int): depth of url
             scraped (bool): whether url has been scraped
         """
-        url = normalize(url)
+        self.add_urls([url], depth, scraped)
+
+    def add_urls(self, urls, depth, scraped=False):
+        """
+        Add a batch of urls to frontier.
+
+        Robots.txt checks take no lock once the domain's robots.txt is cached,
+        so workers adding urls proceed in parallel, and the robots.txt of the
+        batch's new domains are fetched concurrently up front. Urls of a domain
+        whose robots.txt could not be fetched are queued anyway and checked
+        when it can be, see get_tbd_url. Repeats of a url
+        within the batch are dropped before any checks. The urls that
+        pass are saved, counted and queued in bulk, taking each lock once per
+        batch.
+
+        Parameters:
+            urls (iterable): urls to add to frontier
+            depth (int): depth of the urls
+            scraped (bool): whether the urls have been scraped
+        """
+        # pages link the same urls many times over (menus, footers, pagination),
+        # check each distinct url once; dicts keep the order they were found in
+        parsed = list(map(_parse, dict.fromkeys(urls)))
+        # fetch every missing robots.txt at once instead of one after another below
+        missing = [domain for domain in {entry[1] for entry in parsed}
+                   if self._fresh_robots_txt_parser(domain) is False]
+        if len(missing) > 1:
+            try:
+                list(self._robots_executor.map(self.get_robots_txt_parser, missing))
+            except RuntimeError:
+                # close_save has shut the executor down, the loop below fetches them one by one
+                pass
 
-        parsed_url = urlparse(url)
-        domain = parsed_url.netloc
-        fragmentless_url = parsed_url._replace(fragment="").geturl()
-        urlhash = get_urlhash(fragmentless_url)
+        new_domains = []
+        candidates = {}
+        # skipped urls are logged one by one at debug level only, a line per
+        # url costs more than the rest of the check once a sitemap is re-read
+        disallowed = known = unavailable = 0
+        for url, domain, path, hostname, fragmentless_url in parsed:
+            parser = self.get_robots_txt_parser(domain)
+            # Check if the domain is new -> its sitemaps are processed after the batch by
+            # whichever worker claims the domain first, once its robots.txt could be fetched
+            if parser is not None and domain not in self.sitemap_domains:
+                with self.sitemaps_lock:
+                    if domain not in self.sitemap_domains:
+                        self.sitemap_domains.add(domain)
+                        new_domains.append(domain)
 
+            # Check if the url is allowed by robots.txt before paying for hashing it
+            # (a robots.txt that is unavailable for now disallows nothing)
+            if parser is not None and not parser.can_fetch(path):
+                self.logger.debug("URL path of %s not allowed by robots.txt.", url)
+                disallowed += 1
+                continue
 
-        with self.lock and self.robots_parsers_lock:
-            # Check if the url is already in the frontier
-            if urlhash in self.save:
-                self.logger.info(f"URL {url} already in frontier.")
+            urlhash, key = _url_key(fragmentless_url)
+            # Check if the url is already in the frontier; most discovered links are,
+            # so check without the lock first (dict lookups are atomic) and only
+            # take it to confirm and insert
+            if key in self._url_index or key in candidates:
+                self.logger.debug("URL %s already in frontier.", url)
+                known += 1
+                continue
+            candidates[key] = (urlhash, domain, hostname, fragmentless_url)
+            if parser is None:
+                unavailable += 1
+
+        if candidates:
+            with self.save_lock:
+                # another worker may have added some of them since the check above
+                for key in [key for key in candidates if key in self._url_index]:
+                    self.logger.debug("URL %s already in frontier.", candidates.pop(key)[3])
+                    known += 1
+                records = [(urlhash, (fragmentless_url, depth, scraped))
+                           for urlhash, _, _, fragmentless_url in candidates.values()]
+                for urlhash, record in records:
+                    self._record_url(urlhash, *record)
+                # queues hold the urls' row numbers, which exist once recorded
+                by_domain = defaultdict(list)
+                for key, (_, domain, _, _) in candidates.items():
+                    by_domain[domain].append(self._url_index[key])
+            # queued for the writer outside save_lock, see _put_saves; before
+            # the urls are scheduled, so their completion is always queued after
+            if records:
+                self._save_queue.put(records)
+
+        if candidates:
+            # add urls to subdomains
+            with self.subdomains_lock:
+                for _, _, hostname, fragmentless_url in candidates.values():
+                    self.subdomains.setdefault(hostname, set()).add(fragmentless_url)
+            # one acquisition of the scheduler lock for the whole batch
+            with self.url_available:
+                for domain, entries in by_domain.items():
+                    self._enqueue_all(domain, entries)
+
+        if disallowed or known or unavailable:
+            self.logger.info(
+                f"Added {len(candidates)} of {len(parsed)} urls, {disallowed} not allowed "
+                f"by robots.txt, {known} already in frontier, {unavailable} waiting "
+                f"for robots.txt.")
+
+        for domain in new_domains:
+            self.get_sitemap_urls_from_robots_txt(domain, depth)
+
+    def get_sitemap_urls_from_robots_txt(self, domain, depth):
+        """
+        Add the urls listed in the sitemaps named by the robots.txt of domain.
+
+        Parameters:
+            domain (str): domain whose sitemaps to process
+            depth (int): depth to give the sitemap urls
+        """
+        parser = self.get_robots_txt_parser(domain)
+        if parser is None:
+            return
+        for sitemap_url in parser.get_sitemaps():
+            self.add_sitemap_urls(sitemap_url, depth)
+
+    def add_sitemap_urls(self, sitemap_url, depth):
+        """
+        Add the valid urls of a sitemap in chunks, while the rest of it is still being fetched.
+
+        Parameters:
+            sitemap_url (str): url of the sitemap or sitemap index
+            depth (int): depth to give the sitemap urls
+        """
+        pages = self.get_urls_from_sitemap(sitemap_url)
+        for chunk in iter(lambda: list(islice(pages, self.sitemap_chunk_size)), []):
+            self.add_urls([page for page in chunk if is_valid(page)], depth)
+
+    def get_urls_from_sitemap(self, sitemap_url):
+        """
+        Get the page urls listed in a sitemap, following sitemap indexes.
+
+        Sitemap indexes are walked breadth first, fetching the child
+        sitemaps of each level concurrently on an executor shared by all
+        indexes, and yielding each child's urls as soon as it is done.
+        Children on the same host are fetched one after another, each
+        host holding at most one executor slot: _wait_for_turn spaces
+        them politeness_delay apart anyway, so more slots would only sit
+        asleep while other hosts wait. A level of a single sitemap,
+        such as a plain sitemap, is streamed from the parser as it is read.
+        Each sitemap is fetched at most once, so circular indexes terminate.
+
+        Parameters:
+            sitemap_url (str): url of the sitemap or sitemap index
+
+        Yields:
+            str: page urls in the sitemap, as each sitemap is parsed
+        """
+        pending = [sitemap_url]
+        while pending:
+            with self.sitemaps_lock:
+                level = [url for url in dict.fromkeys(pending) if url not in self.fetched_sitemaps]
+                self.fetched_sitemaps.update(level)
+            pending = []
+            if len(level) == 1:
+                yield from self._iter_sitemap(level[0], pending)
+                continue
+            by_host = defaultdict(deque)
+            for url in level:
+                by_host[_parse(url)[1]].append(url)
+            running = {self._sitemap_executor.submit(self._fetch_sitemap, urls.popleft()): host
+                       for host, urls in by_host.items()}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    host = running.pop(future)
+                    # start the host's next sitemap before handing these urls on
+                    if by_host[host]:
+                        next_url = by_host[host].popleft()
+                        running[self._sitemap_executor.submit(self._fetch_sitemap, next_url)] = host
+                    page_urls, child_sitemaps = future.result()
+                    yield from page_urls
+                    pending.extend(child_sitemaps)
+
+    def _fetch_sitemap(self, sitemap_url):
+        """
+        Download and parse a single sitemap.
+
+        Parameters:
+            sitemap_url (str): url of the sitemap or sitemap index
+
+        Returns:
+            tuple: (page urls, child sitemap urls)
+        """
+        sitemaps = []
+        urls = list(self._iter_sitemap(sitemap_url, sitemaps))
+        return urls, sitemaps
+
+    def _iter_sitemap(self, sitemap_url, sitemaps):
+        """
+        Download and parse a single sitemap, yielding its page urls.
+
+        The sitemap is parsed as it downloads, dropping each entry once
+        read, so memory stays flat however large the sitemap is. Gzipped
+        sitemap files are decompressed as they stream in. Plain sitemaps
+        are scanned for their <loc> values directly, anything unusual
+        (namespace prefixes, a DTD) goes through lxml.
+
+        Parameters:
+            sitemap_url (str): url of the sitemap or sitemap index
+            sitemaps (list): child sitemap urls found are appended here
+
+        Yields:
+            str: page urls in the sitemap
+        """
+        self._wait_for_turn(_parse(sitemap_url)[1])
+        resp = download(sitemap_url, self.config, self.logger, stream=True, session=self.http)
+        if resp.status != 200 or resp.raw_response is None:
+            self.logger.info(f"Could not fetch sitemap {sitemap_url}, status <{resp.status}>.")
+            return
+
+        try:
+            stream = io.BufferedReader(resp.raw_response)
+            if stream.peek(len(_GZIP_MAGIC)).startswith(_GZIP_MAGIC):
+                stream = gzip.GzipFile(fileobj=stream)
+            head = stream.peek(_SITEMAP_HEAD_BYTES)[:_SITEMAP_HEAD_BYTES]
+            root = _SITEMAP_ROOT_RE.search(head)
+            if root is not None and root.group(1) is None and b"<!DOCTYPE" not in head:
+                locs = _scan_sitemap_locs(stream, self.logger)
+                if root.group(2) == b"sitemapindex":
+                    sitemaps.extend(locs)
+                else:
+                    yield from locs
                 return
-            # Check if the domain is new -> fetch robots.txt and process sitemaps
-            if domain not in self.robots_parsers.keys():
-                parser = self.get_robots_txt_parser(url)
-                self.get_sitemap_urls_from_robots_txt(url)  
+            # only <loc> elements reach Python; the <url> or <sitemap>
+            # entry around one tells which it is. Whitespace and comments are
+            # dropped while parsing, and custom entities are never expanded,
+            # so huge_tree can't be turned into an entity expansion bomb
+            for _, loc in etree.iterparse(stream, events=("end",),
+                                          tag=_SITEMAP_LOC_TAG, huge_tree=True,
+                                          remove_blank_text=True, remove_comments=True,
+                                          resolve_entities=False):
+                entry = loc.getparent()
+                if entry is None:
+                    continue
+                kind = entry.tag.rpartition('}')[2]
+                if kind not in _SITEMAP_ENTRY_TAGS:
+                    # the <image:loc> or <video:loc> of a <url>, not a page
+                    continue
+                # drop the entries read before this one so the root does
+                # not keep every entry of the sitemap
+                while entry.getprevious() is not None:
+                    del entry.getparent()[0]
+                if loc.text:
+                    if kind == 'sitemap':
+                        sitemaps.append(loc.text.strip())
+                    else:
+                        yield loc.text.strip()
+        except (etree.XMLSyntaxError, OSError, EOFError,
+                urllib3.exceptions.HTTPError, requests.exceptions.RequestException) as e:
+            # a connection dropped mid-stream raises urllib3's errors, not OSError
+            self.logger.error(f"Could not parse sitemap {sitemap_url}: {e}")
+        finally:
+            resp.raw_response.close()
+
+    def _wait_for_turn(self, domain):
+        """
+        Sleep until a request to domain respects the politeness delay.
+
+        Each caller reserves the next free request time of the domain before
+        sleeping, so concurrent sitemap fetches of one host are spread out
+        politeness_delay apart instead of all firing at once, while fetches
+        of different hosts still run in parallel.
+
+        Parameters:
+            domain (str): domain about to be requested
+        """
+        with self.lock:
+            now = time.time()
+            request_time = max(now, self.last_request_time.get(domain, 0) + self._domain_delay(domain))
+            self.last_request_time[domain] = request_time
+        if request_time > now:
+            time.sleep(request_time - now)
+
+    def get_robots_txt_parser(self, domain):
+        """
+        Get the robots.txt parser for domain, refetching it once its TTL has expired.
+
+        While an expired parser is refetched in the background it keeps being
+        served, so only the first contact with a domain waits on the network.
+
+        Parameters:
+            domain (str): domain whose robots.txt to use
+
+        Returns:
+            CustomRobotsParser: parser for the domain, or None if robots.txt could not be fetched
+        """
+        # fresh parsers are read without locking (dict lookups are atomic)
+        parser = self._fresh_robots_txt_parser(domain)
+        if parser is not False:
+            return parser
+        # single flight: the first caller fetches, concurrent callers for the
+        # same domain wait on its future instead of fetching again
+        with self.robots_parsers_lock:
+            parser = self._fresh_robots_txt_parser(domain)
+            if parser is not False:
+                return parser
+            cached = self.robots_parsers.get(domain)
+            stale = cached[0] if cached is not None else None
+            future = self._robots_in_flight.get(domain)
+            fetching = future is None
+            if fetching:
+                future = self._robots_in_flight[domain] = Future()
+        if stale is not None:
+            if fetching:
+                try:
+                    self._robots_executor.submit(self._fetch_robots_txt_parser, domain, future)
+                except RuntimeError:
+                    # close_save has shut the executor down, keep serving the stale parser
+                    with self.robots_parsers_lock:
+                        del self._robots_in_flight[domain]
+                    future.set_result(stale)
+            return stale
+        if not fetching:
+            return future.result()
+        return self._fetch_robots_txt_parser(domain, future)
+
+    def _fetch_robots_txt_parser(self, domain, future):
+        """
+        Fetch the robots.txt parser for domain, store it and resolve the
+        future other callers wait on.
+
+        If the fetch fails while an expired parser is cached, that parser is
+        kept and served until a fetch succeeds, retrying after robots_negative_ttl.
+
+        Parameters:
+            domain (str): domain whose robots.txt to fetch
+            future (Future): the domain's entry in _robots_in_flight
+
+        Returns:
+            CustomRobotsParser: parser for the domain, the stale one if the fetch failed,
+                or None if robots.txt could not be fetched and none is cached
+        """
+        try:
+            parser = self.download_robots_txt_parser_for_domain(domain)
+        except BaseException as e:
+            with self.robots_parsers_lock:
+                del self._robots_in_flight[domain]
+            future.set_exception(e)
+            raise
+        with self.robots_parsers_lock:
+            now = time.time()
+            cached = self.robots_parsers.get(domain)
+            if parser is None and cached is not None and cached[0] is not None:
+                # keep serving the stale parser, retrying after the negative TTL
+                parser = cached[0]
+                self.robots_parsers[domain] = (parser, now - self.robots_ttl + self.robots_negative_ttl)
             else:
-                parser = self.robots_parsers[domain]
-            
-            # add url to subdomains
-            if parsed_url.hostname not in self.subdomains.keys():
-                self.subdomains[parsed_url.hostname] = set()
-            self.subdomains[parsed_url.hostname].add(fragmentless_url)
-
-            # Check if the url is allowed by robots.txt
-            if not parser.can_fetch(parsed_url.path): 
-                self.logger.info(f"URL path of {url} not allowed by robots.txt.")
-                return
+                self.robots_parsers[domain] = (parser, now)
+            if parser is None:
+                self._robots_failures[domain] = self._robots_failures.get(domain, 0) + 1
+            else:
+                self._robots_failures.pop(domain, None)
+            self._dirty_backups.add('robots_parsers')
+            del self._robots_in_flight[domain]
+        future.set_result(parser)
+        return parser
+
+    def _fresh_robots_txt_parser(self, domain):
+        """
+        Get the cached robots.txt parser for domain if its TTL has not expired.
+
+        Parameters:
+            domain (str): domain whose robots.txt to use
+
+        Returns:
+            CustomRobotsParser: the cached parser (None if the fetch failed),
+                or False if there is no fresh one
+        """
+        cached = self.robots_parsers.get(domain)
+        if cached is None:
+            return False
+        parser, fetched_at = cached
+        ttl = self.robots_ttl if parser is not None else self.robots_negative_ttl
+        if time.time() - fetched_at < ttl:
+            return parser
+        return False
+
+    def download_robots_txt_parser_for_domain(self, domain):
+        """
+        Download and parse robots.txt for domain.
+
+        Parameters:
+            domain (str): domain to fetch robots.txt for
+
+        Returns:
+            CustomRobotsParser: parsed robots.txt (allows everything if the domain has none),
+                or None if the fetch failed
+        """
+        resp = download(f"https://{domain}/robots.txt", self.config, self.logger,
+                        max_bytes=self.robots_max_bytes, session=self.http)
+        parser = CustomRobotsParser(self.config.user_agent)
+        if resp.status == 200:
+            if resp.raw_response:
+                parser.parse(resp.raw_response)
+            return parser
+        if resp.status is not None and 400 <= resp.status < 500:
+            # no robots.txt, everything is allowed
+            return parser
+        self.logger.error(f"Could not fetch robots.txt for {domain}, status <{resp.status}>.")
+        return None
+
+    def add_words(self, words, url):
+        """
+        Add the words of a downloaded page to the word counts.
+
+        Only memory is updated; the periodic backup appends the counts added
+        since the last one to word_count.log.
+
+        Parameters:
+            words (Counter): count of each word on the page
+            url (str): url of the page
+        """
+        total = sum(words.values())
+        # Sharding the counts by word hash was tried and doubles the cost per
+        # page for lock time that is already well under a millisecond.
+        with self.words_lock:
+            self._count_words(words)
+            if total > self.max_words[1]:
+                self.max_words = (url, total)
+                self._dirty_backups.add('max_words')
+
+    @property
+    def word_count(self):
+        """
+        Count of every word across downloaded pages.
+
+        Words are kept as a vocabulary, word -> index, and a counts column,
+        so adding a page is one vectorized update instead of a Python-level
+        Counter.update per word. The Counter is built on each access, after
+        releasing words_lock.
+        """
+        with self.words_lock:
+            words, counts = self._word_count_columns()
+        return Counter(dict(zip(words, counts)))
+
+    @word_count.setter
+    def word_count(self, word_count):
+        with self.words_lock:
+            self._vocab_words = [] # index -> word
+            self._vocab = {} # word -> index into _word_counts
+            self._word_counts = _zero_counts(1024)
+            self._count_words(word_count)
+            # counts set here are the baseline the next backup logs from
+            self._logged_word_counts = _zero_counts(0)
+            self._word_count_delta()
+
+    def _word_count_columns(self):
+        """
+        Copy the vocabulary and the counts column. Callers hold words_lock.
+
+        Two flat copies take a fraction of the time of building a Counter
+        over a large vocabulary, which is left to after the lock is released.
+
+        Returns:
+            tuple: (words, counts) lists, in vocabulary order
+        """
+        size = len(self._vocab_words)
+        return self._vocab_words[:size], self._word_counts[:size].tolist()
+
+    def _count_words(self, words):
+        """
+        Add word counts to the vocabulary and counts column. Callers hold words_lock.
+
+        Parameters:
+            words (dict): count of each word to add
+        """
+        vocab = self._vocab
+        new_words = [word for word in words if word not in vocab]
+        if new_words:
+            start = len(self._vocab_words)
+            vocab.update(zip(new_words, range(start, start + len(new_words))))
+            self._vocab_words.extend(new_words)
+            if len(self._vocab_words) > len(self._word_counts):
+                # double the column, so it is copied O(log vocabulary) times
+                grown = _zero_counts(max(len(self._vocab_words), 2 * len(self._word_counts)))
+                grown[:start] = self._word_counts[:start]
+                self._word_counts = grown
+        if numpy is not None:
+            indexes = numpy.fromiter(map(vocab.__getitem__, words), dtype=numpy.intp, count=len(words))
+            # a page counts each word once, so the indexes are unique
+            self._word_counts[indexes] += numpy.fromiter(words.values(), dtype=numpy.int64,
+                                                         count=len(words))
+        else:
+            counts = self._word_counts
+            for word, count in words.items():
+                counts[vocab[word]] += count
+
+    def _word_count_delta(self):
+        """
+        Get the word counts added since the last call, as the word_count.log
+        entry for them. Callers hold words_lock.
+
+        Returns:
+            dict: word -> count added, for the words whose count changed
+        """
+        current = self._word_counts[:len(self._vocab_words)]
+        logged = self._logged_word_counts
+        # slices of a numpy array are views, keep a copy as the new baseline
+        self._logged_word_counts = current.copy() if numpy is not None else current
+        words = self._vocab_words
+        if numpy is not None:
+            added = current.copy()
+            added[:len(logged)] -= logged
+            changed = numpy.flatnonzero(added)
+            return dict(zip([words[index] for index in changed.tolist()],
+                            added[changed].tolist()))
+        return {words[index]: count - (logged[index] if index < len(logged) else 0)
+                for index, count in enumerate(current)
+                if index >= len(logged) or count != logged[index]}
+
+    def get_simhashes(self):
+        """
+        Get the simhash of every page seen so far.
+
+        Returns:
+            dict: simhash fingerprint -> url
+        """
+        with self.simhash_lock:
+            return dict(self.simhashes)
+
+    def add_simhash(self, simhash, url):
+        """
+        Record the simhash of a downloaded page.
+
+        Parameters:
+            simhash (int): 64-bit simhash fingerprint of the page
+            url (str): url of the page
+        """
+        with self.simhash_lock:
+            if simhash not in self.simhashes:
+                self.simhashes[simhash] = url
+                self._index_simhash(simhash)
+                self._logs['simhashes'].write(json.dumps([simhash, url]) + '\n')
+
+    def is_near_duplicate(self, simhash):
+        """
+        Find a page whose simhash is within simhash_max_distance bits of simhash.
+
+        The fingerprint is split into simhash_bands bands and only pages that
+        share a band with it are compared. With more bands than differing
+        bits, any near duplicate matches exactly in at least one band, so no
+        near duplicate is missed.
+
+        Lookups take no lock: add_simhash only ever appends to the band
+        lists, and stores a page's url before indexing its simhash, so
+        concurrent lookups see either the whole entry or none of it. With
+        numpy installed, long buckets are compared in one vectorized pass.
+
+        Parameters:
+            simhash (int): 64-bit simhash fingerprint of the page
+
+        Returns:
+            str: url of a near duplicate page, or None if there is none
+        """
+        for table, packed, key in zip(self._simhash_tables, self._simhash_packed,
+                                      self._simhash_band_keys(simhash)):
+            bucket = table.get(key)
+            if not bucket:
+                continue
+            start = 0
+            if numpy is not None and len(bucket) >= _SIMHASH_VECTORIZE_MIN:
+                # the buffer covers a prefix of the bucket, extended once the
+                # unpacked tail gets long
+                entry = packed.get(key)
+                if entry is None or len(bucket) - entry[1] >= _SIMHASH_VECTORIZE_MIN:
+                    entry = packed[key] = _pack_bucket(bucket, entry)
+                vector = entry[0][:entry[1]]
+                hits = numpy.flatnonzero(
+                    _popcounts(vector ^ numpy.uint64(simhash)) <= self.simhash_max_distance)
+                if len(hits):
+                    return self.simhashes[bucket[hits[0]]]
+                start = len(vector)
+            for candidate in bucket[start:]:
+                if (candidate ^ simhash).bit_count() <= self.simhash_max_distance:
+                    return self.simhashes[candidate]
+        return None
+
+    def _simhash_band_keys(self, simhash):
+        """
+        Split a 64-bit simhash into its band keys, lowest bits first.
+        """
+        width = 64 // self.simhash_bands
+        mask = (1 << width) - 1
+        return [(simhash >> (band * width)) & mask for band in range(self.simhash_bands)]
+
+    def _index_simhash(self, simhash):
+        """
+        Add simhash to the band tables. Callers hold simhash_lock.
+        """
+        for table, key in zip(self._simhash_tables, self._simhash_band_keys(simhash)):
+            table[key].append(simhash)
 
-            self.save[urlhash] = (fragmentless_url, depth, scraped)
-            self.save.sync()
-            self.domains_to_scrape[domain].put((fragmentless_url, depth))
-    
     def get_bad_urls(self):
         """
         Get both low data urls and error urls.
         """
-        with self.lock:
-            return self.low_data_urls.copy(), self.error_urls.copy()
+        return self.low_data_urls, self.error_urls
 
     def add_low_data_url(self, url):
         """
@@ -168,8 +1314,8 @@ class Frontier(object):
         Parameters:
             url (str): url to add
         """
-        with self.lock:
-            self.low_data_urls.add(url)
+        with self.bad_urls_lock:
+            self.low_data_urls = self.low_data_urls | {url}
     
     def add_error_url(self, url, status):
         """
@@ -179,9 +1325,9 @@ class Frontier(object):
             url (str): url to add
             status (int): status code of error
         """
-        with self.lock:
-            if status >= 400:
-                self.error_urls.add(url)
+        if status >= 400:
+            with self.bad_urls_lock:
+                self.error_urls = self.error_urls | {url}
 
     def mark_url_complete(self, url, depth):
         """
@@ -191,73 +1337,422 @@ class Frontier(object):
             url (str): url to mark as completed
             depth (int): depth of url
         """
-        urlhash = get_urlhash(url)
-        with self.lock:
-            if urlhash not in self.save:
-                self.logger.error(
-                    f"Completed url {url}, but have not seen it before.")
+        urlhash, key = _url_key(url)
+        if key not in self._url_index:
+            self.logger.error(
+                f"Completed url {url}, but have not seen it before.")
+        self._put_save(urlhash, (url, depth, True))
+        with self.url_available:
+            if self._in_flight > 0:
+                self._in_flight -= 1
+                # the last url in flight only matters to workers waiting on an
+                # empty frontier, which now stop; with urls still queued the
+                # waiters are already handed their turns one at a time
+                if self._in_flight == 0 and not self._ready:
+                    self.url_available.notify_all()
+
+    def release_url(self, url, requeue=False):
+        """
+        Hand back a url from get_tbd_url without marking it complete.
+
+        Parameters:
+            url (str): url to hand back
+            requeue (bool): queue the url again; otherwise it stays incomplete
+                in the save file and only the next run downloads it
+        """
+        index = self._url_index.get(_url_key(url)[1])
+        with self.url_available:
+            if requeue and index is not None:
+                self._enqueue_all(_parse(url)[1], [index])
+            if self._in_flight > 0:
+                self._in_flight -= 1
+                if self._in_flight == 0 and not self._ready:
+                    self.url_available.notify_all()
+
+    def _put_save(self, urlhash, record):
+        """
+        Record a url in memory and queue it for the background save file writer.
+
+        Parameters:
+            urlhash (str): hash of the url
+            record (tuple): (url, depth, completed) tuple to persist
+        """
+        self._put_saves([(urlhash, record)])
+
+    def _put_saves(self, records):
+        """
+        Record several urls in memory and queue them for the background save
+        file writer as one item.
+
+        The urls are queued after save_lock is released, so when the writer
+        falls behind and the queue is full only the caller waits, not every
+        worker adding or completing urls.
+
+        Parameters:
+            records (list): (urlhash, (url, depth, completed)) pairs to persist
+        """
+        with self.save_lock:
+            for urlhash, record in records:
+                self._record_url(urlhash, *record)
+        self._save_queue.put(records)
+
+    def _record_url(self, urlhash, url, depth, completed):
+        """
+        Store a url in the in-memory url columns. Callers hold save_lock.
+
+        Urls are kept as parallel columns indexed through _url_index instead
+        of one tuple per url: a list of urls, an array of depths and a bitmap
+        of completed flags. _url_index is keyed by the raw 32-byte digest,
+        about half the memory of the 64-character hex string.
+
+        Parameters:
+            urlhash (str): hash of the url
+            url (str): the url
+            depth (int): depth of url
+            completed (bool): whether url has been downloaded
+        """
+        key = bytes.fromhex(urlhash)
+        index = self._url_index.get(key)
+        if index is None:
+            index = len(self._urls)
+            self._url_index[key] = index
+            self._urls.append(url)
+            self._depths.append(depth)
+            if index & 7 == 0:
+                self._completed.append(0)
+        else:
+            self._depths[index] = depth
+        if completed:
+            self._completed[index >> 3] |= 1 << (index & 7)
+        else:
+            self._completed[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    def _save_writer_loop(self):
+        """
+        Drain queued writes into the save file, committing once per batch.
+
+        Writes are collected in a dirty dict, so a url added and completed
+        within the same batch is written once, then flushed with a single
+        executemany inside one transaction. A batch is committed once it
+        holds save_flush_ops urls or its oldest write has waited
+        save_flush_interval seconds; with nothing to commit the thread
+        sleeps until the next write. Runs on a daemon thread until a None
+        sentinel is queued.
+        """
+        dirty = {}
+        deadline = None # time the oldest uncommitted write has to be committed by
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.time())
+            try:
+                item = self._save_queue.get(timeout=timeout)
+            except Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                if not dirty:
+                    deadline = time.time() + self.save_flush_interval
+                dirty.update(item)
+            if dirty and (len(dirty) >= self.save_flush_ops or time.time() >= deadline):
+                self._flush_dirty(dirty)
+                dirty = {}
+                deadline = None
+        if dirty:
+            self._flush_dirty(dirty)
+
+    def _flush_dirty(self, dirty):
+        """
+        Write a batch of url records to the save file in one transaction.
 
-            self.save[urlhash] = (url, depth, True)
-            self.save.sync()
+        Parameters:
+            dirty (dict): (url, depth, completed) record for each urlhash
+        """
+        self.save.execute("BEGIN")
+        # an upsert updates a known url in place, where REPLACE would delete
+        # its row and its primary key entry and insert them again
+        self.save.executemany(
+            "INSERT INTO urls VALUES (?, ?, ?, ?) ON CONFLICT(urlhash) "
+            "DO UPDATE SET depth = excluded.depth, completed = excluded.completed",
+            [(urlhash, url, depth, int(completed))
+             for urlhash, (url, depth, completed) in dirty.items()])
+        self.save.execute("COMMIT")
 
-    def handle_shelves(self, restart):
+    def close_save(self):
         """
-        Handle shelves, delete them if restarting, create them if not restarting.
+        Stop the background writer, flushing any queued writes, and close the save file.
+
+        Periodic backups stop too; call pickle_fields(True) first for a final one.
+        Calling it again does nothing.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.stop_backups()
+        # let running sitemap and robots.txt fetches queue their rows before
+        # the writer is told to stop; ones not started yet are dropped
+        self._sitemap_executor.shutdown(wait=True, cancel_futures=True)
+        self._robots_executor.shutdown(wait=True, cancel_futures=True)
+        self.http.close()
+        with self.simhash_lock, self.words_lock:
+            for log in self._logs.values():
+                log.flush()
+        if self.save is None:
+            return
+        self._save_queue.put(None)
+        self._save_writer.join()
+        self.save.close()
+        self.save = None
+
+    def handle_save_file(self, restart):
+        """
+        Handle the save file, delete it if restarting, create it if not restarting.
 
         Parameters:
             restart (bool): whether or not to restart
         """
+        os.makedirs(self.backups, exist_ok=True)
+        save_path = os.path.join(self.backups, self.config.save_file)
         if restart:
-            if os.path.exists(self.backups + '/' + self.config.save_file + '.db'):
+            if os.path.exists(save_path):
                 self.logger.info(
                     f"Found save file {self.config.save_file}, deleting it.")
-                os.remove(self.backups + '/' + self.config.save_file + '.db')
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(save_path + suffix):
+                        os.remove(save_path + suffix)
         else:
-            if not os.path.exists(self.backups + '/' + self.config.save_file + '.db'):
+            if not os.path.exists(save_path):
                 self.logger.info(
-                    f"Did not find save file {self.backups + '/' + self.config.save_file}, "
+                    f"Did not find save file {save_path}, "
                     f"starting from seed.")
 
         with self.lock:
-            self.save = shelve.open(self.backups + '/' + self.config.save_file)
+            self.save = sqlite3.connect(
+                save_path, check_same_thread=False, isolation_level=None)
+            self.save.execute("PRAGMA journal_mode=WAL")
+            self.save.execute("PRAGMA synchronous=NORMAL")
+            self.save.execute("PRAGMA temp_store=MEMORY")
+            self.save.execute("PRAGMA cache_size=-65536") # 64 MiB page cache
+            self.save.execute("PRAGMA mmap_size=1073741824") # read through a 1 GiB memory map
+            self.save.execute(
+                "CREATE TABLE IF NOT EXISTS urls ("
+                "urlhash TEXT PRIMARY KEY, url TEXT, depth INT, completed INT)")
+            # the urls left to download are found in memory, so an index on
+            # completed would only be rewritten by every completion
+            self.save.execute("DROP INDEX IF EXISTS urls_completed")
+            # load the save file once; all reads are served from memory from here on.
+            # urlhash is the primary key, so the columns are built in bulk
+            rows = self.save.execute("SELECT urlhash, url, depth, completed FROM urls").fetchall()
+            # url digest -> index into the columns below
+            self._url_index = {bytes.fromhex(row[0]): index for index, row in enumerate(rows)}
+            self._urls = [row[1] for row in rows]
+            self._depths = array('I', [row[2] for row in rows])
+            self._completed = bytearray((len(rows) + 7) // 8) # one bit per url
+            for index, row in enumerate(rows):
+                if row[3]:
+                    self._completed[index >> 3] |= 1 << (index & 7)
+            del rows
+            # subdomains hold exactly the saved urls, so they are rebuilt from
+            # the url column rather than backed up and logged separately
+            self.subdomains = defaultdict(set)
+            for url in self._urls:
+                self.subdomains[urlsplit(url).hostname].add(url)
+            # bounded, so a stalled disk slows workers down instead of growing memory
+            self._save_queue = Queue(maxsize=self.save_queue_max)
+            self._save_writer = Thread(target=self._save_writer_loop, daemon=True)
+            self._save_writer.start()
             # check if pickle file exists, if so, load it,
-            for fname, attr in [('subdomains.pkl', defaultdict(set)),
-                                ('last_request_time.pkl', {}),
+            for fname, attr in [('last_request_time.pkl', {}),
                                 ('last_backup_time.pkl', 0),
                                 ('bad_urls.pkl', set()),
-                                ('errors.pkl', set()),]:
+                                ('errors.pkl', set()),
+                                ('robots_parsers.pkl', {}),
+                                ('word_count.pkl', Counter()),
+                                ('max_words.pkl', (None, 0)),
+                                ('simhashes.pkl', {}),]:
                 path = os.path.join(self.backups, fname)
-                if os.path.exists(path) and not restart:
-                    with open(path, 'rb') as f:
-                        setattr(self, fname[:-4], pickle.load(f))
+                if os.path.exists(path) and restart:
+                    # the last crawl's snapshot must not meet this crawl's
+                    # logs if the next start resumes before it is rewritten
+                    os.remove(path)
+                if os.path.exists(path):
+                    setattr(self, fname[:-4], _load_backup(path, fname[:-4]))
                 else:
                     setattr(self, fname[:-4], attr)
-
-            self.save.sync()
+            self._open_logs(restart)
+            # one table per band, band key -> simhashes having it
+            self._simhash_tables = [defaultdict(list) for _ in range(self.simhash_bands)]
+            # numpy copies of long buckets, band key -> (uint64 buffer, count)
+            self._simhash_packed = [{} for _ in range(self.simhash_bands)]
+            for simhash in self.simhashes:
+                self._index_simhash(simhash)
     
-    def pickle_fields(self, force=False):
+    def _open_logs(self, restart):
+        """
+        Replay the append logs of simhashes and word_count onto their last
+        snapshot and open them for appending.
+
+        Parameters:
+            restart (bool): whether or not to restart, discarding the logs
+        """
+        self._logs = {}
+        for name in ('simhashes', 'word_count'):
+            path = os.path.join(self.backups, name + '.log')
+            # .old holds the entries of a compaction that may not have finished
+            for log_path in (path + '.old', path):
+                if not os.path.exists(log_path):
+                    continue
+                if restart:
+                    os.remove(log_path)
+                    continue
+                for entry in _replay_log(log_path):
+                    if name == 'simhashes':
+                        self.simhashes.setdefault(entry[0], entry[1])
+                    else:
+                        # one line of words counted between two backups
+                        self._count_words(entry)
+            self._logs[name] = open(path, 'a', encoding='utf-8')
+        # everything counted so far is on disk already
+        self._word_count_delta()
+
+    def _rotate_logs(self):
+        """
+        Move the append logs aside to .old before their structures are
+        snapshotted, starting empty logs. Callers hold the locks of both
+        structures.
+        """
+        for name, log in self._logs.items():
+            log.close()
+            path = os.path.join(self.backups, name + '.log')
+            if os.path.exists(path + '.old'):
+                # the last compaction did not finish, keep its entries too
+                with open(path + '.old', 'ab') as old, open(path, 'rb') as new:
+                    shutil.copyfileobj(new, old)
+                os.remove(path)
+            else:
+                os.replace(path, path + '.old')
+            self._logs[name] = open(path, 'a', encoding='utf-8')
+
+    def stop_backups(self):
+        """
+        Stop the periodic backups, waiting for one under way to finish, so a
+        final pickle_fields afterwards is the last backup written.
+        """
+        self._stop_backups.set()
+        if self._backup_thread is not current_thread():
+            self._backup_thread.join()
+
+    def _backup_loop(self):
+        """
+        Pickle fields every backup_interval seconds, off the workers' threads,
+        until close_save is called.
+        """
+        while not self._stop_backups.wait(self.backup_interval):
+            self.pickle_fields(force=True)
+
+    def pickle_fields(self, force=False, compact=False):
         """
         Pickle fields.
+
+        Each field is copied under its own lock only, one at a time, and pickled
+        after releasing it, so workers are blocked at most for one copy and
+        never while the backup is written. Fields unchanged since their last
+        backup are not written again. simhashes and word_count are kept
+        in append logs, flushed on every backup and only snapshotted every
+        log_compact_every backups; word_count only appends the counts added
+        since the last backup. subdomains are rebuilt from the save file,
+        which is copied whenever the logs are compacted.
+
+        Parameters:
+            force (bool): back up even if backup_interval has not passed
+            compact (bool): snapshot simhashes and word_count now, as a final
+                backup does so the next start has no logs to replay
         """
-        current_time = time.time()
-        if current_time - self.last_backup_time > self.backup_interval or force:
-            with self.lock and self.robots_parsers_lock and self.sitemaps_lock and self.simhash_lock:
-                time.sleep(10)
-                with open(self.backups + '/subdomains.pkl', 'wb') as f:
-                    pickle.dump(self.subdomains, f)
-                with open(self.backups + '/last_request_time.pkl', 'wb') as f:
-                    pickle.dump(self.last_request_time, f)
-                with open(self.backups + '/bad_urls.pkl', 'wb') as f:
-                    pickle.dump(self.bad_urls, f)
-                with open(self.backups + '/errors.pkl', 'wb') as f:
-                    pickle.dump(self.errors, f)
+        # one backup at a time, from the check through the dumps and the log
+        # removal: two compactions would rotate the logs twice and race to
+        # remove the same .old files, and an older snapshot could land last
+        with self.backup_lock:
+            with self.lock:
+                current_time = time.time()
+                if current_time - self.last_backup_time <= self.backup_interval and not force:
+                    return
                 self.last_backup_time = current_time
+                snapshot = {}
+                snapshot['last_request_time'] = dict(self.last_request_time)
+                if self._take_dirty('bad_urls'):
+                    snapshot['bad_urls'] = set(self.bad_urls)
+                if self._take_dirty('errors'):
+                    snapshot['errors'] = set(self.errors)
+            with self.robots_parsers_lock:
+                if self._take_dirty('robots_parsers'):
+                    snapshot['robots_parsers'] = dict(self.robots_parsers)
+            with self.simhash_lock, self.words_lock:
+                if self._take_dirty('max_words'):
+                    snapshot['max_words'] = self.max_words
+                delta = self._word_count_delta()
+                if delta:
+                    self._logs['word_count'].write(json.dumps(delta) + '\n')
+                for log in self._logs.values():
+                    log.flush()
+                self._backups_since_compaction += 1
+                compact = compact or self._backups_since_compaction >= self.log_compact_every
+                if compact:
+                    snapshot['simhashes'] = dict(self.simhashes)
+                    word_columns = self._word_count_columns()
+                    self._rotate_logs()
+                    self._backups_since_compaction = 0
+            if compact:
+                snapshot['word_count'] = Counter(dict(zip(*word_columns)))
+            for name, value in snapshot.items():
+                _dump_backup(os.path.join(self.backups, name + '.pkl'), value, name)
+            if compact:
+                # the snapshots now hold everything the old logs did
+                for name in self._logs:
+                    os.remove(os.path.join(self.backups, name + '.log.old'))
+                self._backup_save_file()
+
+    def _backup_save_file(self):
+        """
+        Copy the save file to <save_file>.bak with SQLite's online backup API.
+
+        The copy is read through its own connection in a single step, a
+        consistent snapshot that in WAL mode never blocks the background
+        writer, and only replaces the previous copy once complete.
+        """
+        save_path = os.path.join(self.backups, self.config.save_file)
+        if not os.path.exists(save_path):
+            return
+        source = sqlite3.connect(save_path)
+        dest = sqlite3.connect(save_path + '.bak.tmp')
+        try:
+            source.backup(dest)
+        finally:
+            dest.close()
+            source.close()
+        os.replace(save_path + '.bak.tmp', save_path + '.bak')
+
+    def _take_dirty(self, name):
+        """
+        Check whether a backup changed since it was last written, clearing
+        the mark. Callers hold the lock of the backed up field.
+
+        Parameters:
+            name (str): name of the backup
+
+        Returns:
+            bool: whether the backup has to be written
+        """
+        if name in self._dirty_backups:
+            self._dirty_backups.discard(name)
+            return True
+        return False
 
     def __del__(self):
         """
         Destructor for Frontier class.
+
+        Only closes the save file if nobody did; backups are taken explicitly
+        before closing, since module globals may already be gone here.
         """
-        if self.save is not None:
-            self.save.close()
-        self.pickle_fields()
+        if not getattr(self, '_closed', True):
+            self.close_save()
 
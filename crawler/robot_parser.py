@@ -1,49 +1,166 @@
+import re
+
+# a directive and its value, up to any whitespace or trailing comment
+_DIRECTIVE_PATTERN = r"^[ \t]*(user-agent|allow|disallow|crawl-delay|sitemap)[ \t]*:[ \t]*([^\s#]*)"
+_DIRECTIVE_RE = re.compile(_DIRECTIVE_PATTERN, re.IGNORECASE | re.MULTILINE)
+# the same, run on the raw download
+_DIRECTIVE_BYTES_RE = re.compile(_DIRECTIVE_PATTERN.encode(), re.IGNORECASE | re.MULTILINE)
+
+# paths whose decision is remembered per parser, oldest are dropped first
+_DECISIONS_MAX = 16384
+
+
+def _compress_tails(node, depth):
+    # the part of a rule no other rule shares is a chain of one-child dicts,
+    # most of a rule-heavy trie's dicts; each such chain is replaced by a
+    # (rest of the rule, its offset in the path, allowed) tuple
+    for char, child in node.items():
+        if char is None:
+            continue
+        tail = ''
+        end = child
+        while len(end) == 1 and None not in end:
+            (next_char, end), = end.items()
+            tail += next_char
+        if tail and len(end) == 1:
+            node[char] = (tail, depth, end[None])
+        else:
+            # the chain up to end has nothing to compress, carry on below it
+            _compress_tails(end, depth + 1 + len(tail))
+    return node
+
+
 class CustomRobotsParser:
+    # seconds between requests asked for by the matching group, if any;
+    # a class default so parsers pickled before it existed still have it
+    crawl_delay = None
+
     def __init__(self, user_agent='*'):
         self.user_agent = user_agent
         self.allowed = []
         self.disallowed = []
         self.sitemaps = []
         self.current_user_agent = None
+        self._trie = None
+        self._decisions = {}
 
-    def parse(self, content):
-        lines = content.split('\n')
-        for line in lines:
-            # Remove any comment portion of the line
-            line = line.split('#', 1)[0].strip()
-            if not line:
-                continue  # skip blank lines
-
-            line_parts = line.split(':', 1)
-            if len(line_parts) != 2:
-                # Malformed line
-                continue
+    def __getstate__(self):
+        # the trie and the decision memo are rebuilt on demand from the rule
+        # lists, keep them out of backups; a trie is many small dicts per rule
+        state = self.__dict__.copy()
+        state['_trie'] = None
+        state['_decisions'] = {}
+        return state
 
-            directive, value = line_parts
-            directive = directive.strip().lower()
-            value = value.strip()
+    def parse(self, content):
+        # robots.txt bodies come straight from the download as bytes; the
+        # regex runs on them directly and only the values it finds are
+        # decoded, CRLF line ends need no rewriting either
+        if isinstance(content, bytes):
+            directives = [(directive.decode('ascii'), value.decode('utf-8', errors='ignore'))
+                          for directive, value in _DIRECTIVE_BYTES_RE.findall(content)]
+        else:
+            directives = _DIRECTIVE_RE.findall(content)
+        # rules of every user-agent group, as (agents, allowed, disallowed, crawl delays)
+        groups = []
+        in_agent_lines = False
+        # one pass over the whole file; blank, comment and malformed lines never match
+        for directive, value in directives:
+            directive = directive.lower()
 
             if directive == 'user-agent':
+                # consecutive user-agent lines share one group of rules
+                if not in_agent_lines:
+                    groups.append((set(), [], [], []))
+                agent = value.split('/', 1)[0].lower()
+                if agent:
+                    groups[-1][0].add(agent)
                 self.current_user_agent = value
-            elif directive == 'sitemap':
+                in_agent_lines = True
+                continue
+            in_agent_lines = False
+            if directive == 'sitemap':
                 self.sitemaps.append(value)
-            elif self.current_user_agent == self.user_agent or self.current_user_agent == '*':
+            elif groups and value:
                 if directive == 'allow':
-                    if value is not None and value != '':
-                        self.allowed.append(value)
-                elif directive == 'disallow':  
-                    if value is not None and value != '':
-                        self.disallowed.append(value)
-            
+                    groups[-1][1].append(value)
+                elif directive == 'disallow':
+                    groups[-1][2].append(value)
+                elif directive == 'crawl-delay':
+                    try:
+                        groups[-1][3].append(float(value))
+                    except ValueError:
+                        pass
+
+        # a group naming this user agent's product token (the part before
+        # any '/version', case-insensitively) replaces the '*' group
+        product_token = self.user_agent.split('/', 1)[0].strip().lower()
+        matching = [group for group in groups if product_token in group[0]] if product_token else []
+        if not matching:
+            matching = [group for group in groups if '*' in group[0]]
+        for _, allowed, disallowed, crawl_delays in matching:
+            self.allowed.extend(allowed)
+            self.disallowed.extend(disallowed)
+            if crawl_delays:
+                self.crawl_delay = max(crawl_delays + [self.crawl_delay or 0])
+        self._build_trie()
+
+    def _build_trie(self):
+        # character trie of rule paths; the None key marks the end of a rule
+        # and holds whether it allows the path
+        trie = {}
+        for rules, allowed in ((self.disallowed, False), (self.allowed, True)):
+            for rule in rules:
+                node = trie
+                for char in rule:
+                    node = node.setdefault(char, {})
+                # allow wins if a path is both allowed and disallowed
+                node[None] = allowed or node.get(None, False)
+        self._trie = _compress_tails(trie, 1)
+        self._decisions = {}
 
     def can_fetch(self, path):
-        for disallowed_path in self.disallowed:
-            if path.startswith(disallowed_path):
-                for allowed_path in self.allowed:
-                    if path.startswith(allowed_path):
-                        return True
-                return False
-        return True
+        if self._trie is None:
+            self._build_trie()
+        if not self._trie:
+            # most sites have no rules for us (or no robots.txt at all), so
+            # there is nothing to match and no decision worth remembering
+            return True
+        # sites repeat the same paths a lot, so remember recent decisions;
+        # frontier passes the path without its query, which bounds the keys
+        allowed = self._decisions.get(path)
+        if allowed is None:
+            allowed = self._match(path)
+            if len(self._decisions) >= _DECISIONS_MAX:
+                # dicts keep insertion order, drop the oldest decision rather
+                # than the whole memo so hot paths stay cached
+                try:
+                    del self._decisions[next(iter(self._decisions))]
+                except (StopIteration, KeyError, RuntimeError):
+                    # another worker evicted it or grew the memo meanwhile
+                    pass
+            self._decisions[path] = allowed
+        return allowed
+
+    def _match(self, path):
+        # the longest rule that prefixes path decides, everything else is allowed
+        path = path or '/'
+        node = self._trie
+        allowed = True
+        try:
+            for char in path:
+                node = node.get(char)
+                if node is None:
+                    break
+                if None in node:
+                    allowed = node[None]
+        except AttributeError:
+            # walked into the tail of a rule no other rule shares, the rest
+            # of it is matched in one comparison
+            tail, offset, rule_allowed = node
+            if path.startswith(tail, offset):
+                allowed = rule_allowed
+        return allowed
 
     def get_sitemaps(self):
         return self.sitemaps
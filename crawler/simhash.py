@@ -10,6 +10,31 @@ class SimHash:
         """
         Calculates the Simhash value for a given set of tokens and their weights.
 
+        Args:
+            counter (Counter): A Counter object containing the tokens and their weights.
+
+        Returns:
+            int: The Simhash value.
+        """
+        if self.num_bits > 64 or not counter:
+            return self._simhash_loop(counter)
+        # every token's hash as a row of 0/1 bytes, lowest bit first, unpacked
+        # from its little-endian bytes rather than shifted out one bit at a time
+        hashes = np.fromiter((hash(t) for t in counter), dtype='<i8', count=len(counter))
+        counts = np.fromiter(counter.values(), dtype=np.int64, count=len(counter))
+        bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1,
+                             bitorder='little')[:, :self.num_bits]
+        # +count where a bit is set and -count where it isn't, summed per bit:
+        # twice the counts of the set bits, less all counts
+        weights = 2 * (counts @ bits) - counts.sum()
+        # calc fingerprint
+        return int.from_bytes(np.packbits(weights >= 0, bitorder='little').tobytes(), 'little')
+
+    def _simhash_loop(self, counter: Counter):
+        """
+        Calculates the Simhash value one token and bit at a time, for
+        fingerprints wider than the 64-bit token hashes.
+
         Args:
             counter (Counter): A Counter object containing the tokens and their weights.
 
@@ -42,7 +67,7 @@ class SimHash:
         Returns:
             float: The similarity between the two objects. A value of 1 indicates a perfect match, while a value of 0 indicates no similarity.
         """
-        # get different bits
-        x = (self.hash ^ other_hash.hash) & ((1 << self.num_bits) - 1)
-        # return proportion of different bits
-        return (self.num_bits - bin(x).count('1')) / float(self.num_bits)
\ No newline at end of file
+        # count different bits; both fingerprints are num_bits wide already
+        different = (self.hash ^ other_hash.hash).bit_count()
+        # return proportion of same bits
+        return (self.num_bits - different) / float(self.num_bits)
\ No newline at end of file
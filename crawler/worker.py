@@ -6,6 +6,7 @@ from utils import get_logger
 import scraper
 from urllib.parse import urlparse, parse_qs
 from difflib import SequenceMatcher
+from functools import lru_cache
 
 
 
@@ -44,106 +45,134 @@ class Worker(Thread):
     def run(self):
         """
         Run the worker loop until there are no more URLs to be downloaded.
+
+        Every url taken from the frontier is either marked complete or, if
+        processing it raised, handed back with release_url, so the frontier
+        never waits forever on a url no worker is processing.
         """
         while True:
             tbd_url, depth = self.frontier.get_tbd_url()
             if tbd_url is None:
                 self.logger.info("Frontier is empty. Stopping.")
                 break
-                
-            if depth > self.max_depth:
-                self.logger.info(f"Skipping {tbd_url}, reached max depth.")
-                self.frontier.mark_url_complete(tbd_url, depth)
-                continue
-
-            # check if url is similar to low data urls
-            low_data, error = self.frontier.get_bad_urls()
-            if is_similar_url(tbd_url, low_data):
-                self.logger.info(f"Skipping {tbd_url}, similar to previous low data urls.")
-                self.frontier.mark_url_complete(tbd_url, depth)
-                self.frontier.add_low_data_url(tbd_url, 404)
-                continue
-
-            # check if url is similar to error urls
-            if is_similar_url(tbd_url, error):
-                self.logger.info(f"Skipping {tbd_url}, similar to previous error urls.")
-                self.frontier.mark_url_complete(tbd_url, depth)
-                self.frontier.add_error_url(tbd_url, 404)
-                continue
-                
-            # check if meets common trap criteria
-            is_trap, pattern = scraper.is_infinite_trap(tbd_url)
-            if is_trap:
-                self.logger.info(f"Skipping {tbd_url}, infinite trap detected {pattern}.")
-                self.frontier.mark_url_complete(tbd_url, depth)
-                continue
 
+            completed = False
             try:
-                resp = download(tbd_url, self.config, self.logger)
-            except Exception as e:
-                self.logger.error(f"Error while downloading {tbd_url}: {str(e)}")
-                self.frontier.mark_url_complete(tbd_url, depth)
-                continue
-
-            # check if resp is a redirect or error
-            if 300 <= resp.status <= 399:
-                self.logger.info(f"Skipping {tbd_url}, status <{resp.status}>.")
-                redirect_url = resp.raw_response.headers.get('Location')
-                if redirect_url is not None:
-                    self.logger.info(f"Redirected {tbd_url} to {redirect_url}.")
-                    self.frontier.add_url(redirect_url, depth)
+                self.process_url(tbd_url, depth)
                 self.frontier.mark_url_complete(tbd_url, depth)
-                continue
-            elif resp.status != 200:
-                self.frontier.add_error_url(tbd_url, resp.status)
-                self.logger.info(f"Skipping {tbd_url}, status <{resp.status}>.")
-                self.frontier.mark_url_complete(tbd_url, depth)
-                continue
+                completed = True
+            except Exception as e:
+                self.logger.error(f"Error while processing {tbd_url}: {str(e)}")
+            finally:
+                if not completed:
+                    # left incomplete in the save file, the next run retries it
+                    self.frontier.release_url(tbd_url)
 
-            # check if resp.raw_response is None
-            if resp.raw_response is None:
-                self.logger.info(f"Skipping {tbd_url}, empty raw_response.")
-                self.frontier.mark_url_complete(tbd_url, depth)
-                continue
+    def process_url(self, tbd_url, depth):
+        """
+        Download and scrape a url, adding the urls found to the frontier.
 
-            # scrape the resp
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
-            
-            try:
-                scraped_urls, words, simhash = scraper.scraper(tbd_url, resp)
-            except Exception as e:
-                self.logger.error(f"Error while scraping {tbd_url}: {str(e)}")
-                self.frontier.mark_url_complete(tbd_url, depth)
-                continue
+        Skipped urls return early; run marks the url complete afterwards.
 
-            # check if there is very little content
-            if words is not None and len(words) < self.min_words:
-                self.logger.info(f"Skipping {tbd_url}, too few words.")
-                url_hash = scraper.SimHash(words)
-                self.frontier.add_low_data_url(tbd_url)
-                self.frontier.mark_url_complete(tbd_url, depth)
-                continue
-            
-            similar = False
-            if simhash is not None:
-                simhashes = self.frontier.get_simhashes()
-                similar = self.is_similar(simhash, simhashes)
-                self.frontier.add_simhash(simhash, tbd_url)
-
-            if similar:
-                self.logger.info(f"Skipping {tbd_url}, similar content.")
-                self.frontier.mark_url_complete(tbd_url, depth)
-                continue
-            
-            # add scraped words to frontier
-            if words is not None:
-                self.frontier.add_words(words, tbd_url)
+        Args:
+            tbd_url (str): The url to process.
+            depth (int): The depth of the url.
+        """
+        if depth > self.max_depth:
+            self.logger.info(f"Skipping {tbd_url}, reached max depth.")
+            return
+
+        # check if url is similar to low data urls
+        low_data, error = self.frontier.get_bad_urls()
+        if is_similar_url(tbd_url, low_data):
+            self.logger.info(f"Skipping {tbd_url}, similar to previous low data urls.")
+            self.frontier.add_low_data_url(tbd_url)
+            return
+
+        # check if url is similar to error urls
+        if is_similar_url(tbd_url, error):
+            self.logger.info(f"Skipping {tbd_url}, similar to previous error urls.")
+            self.frontier.add_error_url(tbd_url, 404)
+            return
             
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url, depth + 1)
-            self.frontier.mark_url_complete(tbd_url, depth)
+        # check if meets common trap criteria
+        is_trap, pattern = scraper.is_infinite_trap(tbd_url)
+        if is_trap:
+            self.logger.info(f"Skipping {tbd_url}, infinite trap detected {pattern}.")
+            return
+
+        try:
+            resp = download(tbd_url, self.config, self.logger)
+        except Exception as e:
+            self.logger.error(f"Error while downloading {tbd_url}: {str(e)}")
+            return
+
+        # check if resp is a redirect or error
+        if 300 <= resp.status <= 399:
+            self.logger.info(f"Skipping {tbd_url}, status <{resp.status}>.")
+            redirect_url = resp.raw_response.headers.get('Location')
+            if redirect_url is not None:
+                self.logger.info(f"Redirected {tbd_url} to {redirect_url}.")
+                self.frontier.add_url(redirect_url, depth)
+            return
+        elif resp.status != 200:
+            self.frontier.add_error_url(tbd_url, resp.status)
+            self.logger.info(f"Skipping {tbd_url}, status <{resp.status}>.")
+            return
+
+        # check if resp.raw_response is None
+        if resp.raw_response is None:
+            self.logger.info(f"Skipping {tbd_url}, empty raw_response.")
+            return
+
+        # scrape the resp
+        self.logger.info(
+            f"Downloaded {tbd_url}, status <{resp.status}>, "
+            f"using cache {self.config.cache_server}.")
+        
+        try:
+            scraped_urls, words, simhash = scraper.scraper(tbd_url, resp)
+        except Exception as e:
+            self.logger.error(f"Error while scraping {tbd_url}: {str(e)}")
+            return
+
+        # check if there is very little content
+        if words is not None and len(words) < self.min_words:
+            self.logger.info(f"Skipping {tbd_url}, too few words.")
+            self.frontier.add_low_data_url(tbd_url)
+            return
+        
+        similar = False
+        if simhash is not None:
+            similar = self.frontier.is_near_duplicate(simhash) is not None
+            self.frontier.add_simhash(simhash, tbd_url)
+
+        if similar:
+            self.logger.info(f"Skipping {tbd_url}, similar content.")
+            return
+        
+        # add scraped words to frontier
+        if words is not None:
+            self.frontier.add_words(words, tbd_url)
+        
+        self.frontier.add_urls(scraped_urls, depth + 1)
+
+
+@lru_cache(maxsize=262144)
+def url_tokens(url):
+    """
+    Split a URL into its host and the set of path segments and query parameters.
+
+    Memoized, since every URL is compared against the whole set of bad URLs.
+
+    Parameters:
+        url (str): URL to split.
+    Returns:
+        tuple: (netloc, frozenset of path segments and (key, values) query pairs).
+    """
+    parsed = urlparse(url)
+    tokens = set(parsed.path.split('/')) | set((k, tuple(v)) for k, v in parse_qs(parsed.query).items())
+    return parsed.netloc, frozenset(tokens)
 
 
 def jaccard_similarity(url1, url2):
@@ -154,16 +183,13 @@ def jaccard_similarity(url1, url2):
     Returns:
         float: Jaccard similarity.
     """
-    parsed1 = urlparse(url1)
-    parsed2 = urlparse(url2)
+    netloc1, set1 = url_tokens(url1)
+    netloc2, set2 = url_tokens(url2)
 
     # If the domains/hosts are different, return 0
-    if parsed1.netloc != parsed2.netloc:
+    if netloc1 != netloc2:
         return 0
 
-    set1 = set(parsed1.path.split('/')) | set((k, tuple(v)) for k, v in parse_qs(parsed1.query).items())
-    set2 = set(parsed2.path.split('/')) | set((k, tuple(v)) for k, v in parse_qs(parsed2.query).items())
-
     intersection = set1 & set2
     union = set1 | set2
 
@@ -1,5 +1,7 @@
 from configparser import ConfigParser
 from argparse import ArgumentParser
+import signal
+import sys
 
 #from utils.server_registration import get_cache_server
 from utils.config import Config
@@ -22,8 +24,19 @@ def main(config_file, restart):
     config = Config(cparser)
     #config.cache_server = get_cache_server(config, restart)
     crawler = Crawler(config, restart)
+
+    def shutdown(signum, frame):
+        # back up once more before exiting, daemon threads won't get the chance
+        crawler.frontier.stop_backups()
+        crawler.frontier.pickle_fields(True, compact=True)
+        crawler.frontier.close_save()
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, shutdown)
+
     crawler.start()
-    crawler.frontier.pickle_fields(True)
+    crawler.frontier.stop_backups()
+    crawler.frontier.pickle_fields(True, compact=True)
+    crawler.frontier.close_save()
 
 
 if __name__ == "__main__":
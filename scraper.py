@@ -1,5 +1,6 @@
 import re
 from collections import Counter
+from functools import lru_cache
 from urllib.parse import urljoin, urlparse, parse_qs
 #from nltk.corpus import stopwords
 from bs4 import BeautifulSoup
@@ -8,6 +9,17 @@ from bs4 import BeautifulSoup
 
 MAX_CONTENT_LENGTH = 10000000 # 10MB
 
+# Only allow domains from poewiki.net to any page that looks like poewiki.net/wiki/{anything}
+ALLOWED_URL_PATTERN = re.compile(r"https?://poewiki\.net/wiki/[a-zA-Z0-9_\-./;?%&=+#]*?")
+BAD_EXTENSION_PATTERN = re.compile(
+    r"\.(css|js|bmp|gif|jpe?g|ico|png|tiff?|mid|mp2|mp3|mp4"
+    r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
+    r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
+    r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
+    r"|epub|dll|cnf|tgz|sha1"
+    r"|thmx|mso|arff|rtf|jar|csv"
+    r"|rm|smil|wmv|swf|wma|zip|rar|gz|pdf)$")
+
 
 def scraper(url, resp):
     """
@@ -75,31 +87,27 @@ def extract_text_and_next_links(url, resp):
 
 
 # FIXME: Modify this to only validate urls that look like poewiki.net/wiki/{anything}
+@lru_cache(maxsize=262144)
 def is_valid(url):
     """
     Checks if the URL is valid based on the given requirements.
 
+    Results are memoized, since the same links are rediscovered on many pages.
+
     Args:
         url (str): The URL to be checked.
 
     Returns:
         bool: True if the URL is valid, False otherwise.
     """
-    
-    # Only allow domains from poewiki.net to any page that looks like poewiki.net/wiki/{anything}
-    allowed_domains = [
-                        r"https?://poewiki\.net/wiki/[a-zA-Z0-9_\-./;?%&=+#]*?"
-                        ]
-
-
     try:
-        parsed = urlparse(url)._replace(fragment='')
-        if not parsed.scheme or not parsed.hostname:
+        # Check if the URL belongs to one of the allowed domains; most links
+        # don't, so this runs before the URL is parsed
+        if not ALLOWED_URL_PATTERN.match(url):
             return False
 
-        # Check if the URL belongs to one of the allowed domains
-        valid_domain = any(re.match(domain, url) for domain in allowed_domains)
-        if not valid_domain:
+        parsed = urlparse(url)
+        if not parsed.scheme or not parsed.hostname:
             return False
         
         is_trap , trap_type = is_infinite_trap(url)
@@ -108,13 +116,7 @@ def is_valid(url):
 
         # Additional checks for URL patterns
         # Add more checks here if needed
-        return not re.match(r".*\.(css|js|bmp|gif|jpe?g|ico|png|tiff?|mid|mp2|mp3|mp4"
-                            r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-                            r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-                            r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-                            r"|epub|dll|cnf|tgz|sha1"
-                            r"|thmx|mso|arff|rtf|jar|csv"
-                            r"|rm|smil|wmv|swf|wma|zip|rar|gz|pdf)$", url.lower())
+        return not BAD_EXTENSION_PATTERN.search(url.lower())
 
     except TypeError:
         return False
@@ -0,0 +1,141 @@
+import os
+import tempfile
+import threading
+import unittest
+from configparser import ConfigParser
+from unittest.mock import patch
+from crawler.frontier import Frontier, load_results
+from crawler.robot_parser import CustomRobotsParser
+from utils.config import Config
+
+
+class TestFrontierBackup(unittest.TestCase):
+
+    def setUp(self):
+        cparser = ConfigParser()
+        cparser.read("config.ini")
+        config = Config(cparser)
+        config.seed_urls = []
+        config.time_delay = 0
+        self.config = config
+
+        # the frontier keeps its save file and backups in the working directory
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+
+        patcher = patch("crawler.frontier.Frontier.download_robots_txt_parser_for_domain",
+                        new=lambda frontier, domain: CustomRobotsParser(config.user_agent))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open_frontier(self, restart):
+        frontier = Frontier(self.config, restart)
+        self.addCleanup(frontier.close_save)
+        return frontier
+
+    def fill(self, frontier):
+        frontier.add_urls(["https://a.com/1", "https://a.com/2"], 0)
+        url, depth = frontier.get_tbd_url()
+        frontier.mark_url_complete(url, depth)
+        frontier.add_simhash(0x0123456789abcdef, url)
+        frontier.add_words({"exile": 3, "path": 2}, url)
+        return url
+
+    def assert_restored(self, frontier, completed_url):
+        self.assertEqual(frontier.get_simhashes(), {0x0123456789abcdef: completed_url})
+        self.assertEqual(frontier.word_count, {"exile": 3, "path": 2})
+        self.assertEqual(frontier.max_words, (completed_url, 5))
+        # only the url that was not completed is queued again
+        self.assertEqual(len(frontier._url_index), 2)
+        url, _ = frontier.get_tbd_url()
+        self.assertNotEqual(url, completed_url)
+
+    def test_resume_replays_logs(self):
+        frontier = self.open_frontier(restart=True)
+        completed_url = self.fill(frontier)
+        frontier.pickle_fields(force=True)
+        frontier.close_save()
+        # nothing compacted: the simhash and word counts are only in the logs
+        with open(os.path.join("backup_datastructures", "simhashes.log")) as log:
+            self.assertTrue(log.read())
+
+        self.assert_restored(self.open_frontier(restart=False), completed_url)
+
+    def test_compaction_truncates_logs(self):
+        frontier = self.open_frontier(restart=True)
+        completed_url = self.fill(frontier)
+        frontier.pickle_fields(force=True, compact=True)
+        frontier.close_save()
+        for name in ("simhashes", "word_count"):
+            path = os.path.join("backup_datastructures", name)
+            self.assertEqual(os.path.getsize(path + ".log"), 0)
+            self.assertFalse(os.path.exists(path + ".log.old"))
+            self.assertTrue(os.path.exists(path + ".pkl"))
+
+        frontier = self.open_frontier(restart=False)
+        self.assert_restored(frontier, completed_url)
+        # a page added after the compaction is appended to the fresh logs
+        frontier.add_words({"exile": 1}, "https://a.com/3")
+        frontier.pickle_fields(force=True)
+        frontier.close_save()
+        self.assertEqual(self.open_frontier(restart=False).word_count,
+                         {"exile": 4, "path": 2})
+
+    def test_concurrent_compactions(self):
+        frontier = self.open_frontier(restart=True)
+        completed_url = self.fill(frontier)
+        # the backup thread and a final backup compacting at the same time
+        barrier = threading.Barrier(2)
+        errors = []
+
+        def backup():
+            barrier.wait()
+            try:
+                frontier.pickle_fields(force=True, compact=True)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=backup) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        frontier.close_save()
+
+        self.assert_restored(self.open_frontier(restart=False), completed_url)
+
+    def test_restart_drops_last_crawl(self):
+        frontier = self.open_frontier(restart=True)
+        self.fill(frontier)
+        frontier.pickle_fields(force=True, compact=True)
+        frontier.close_save()
+
+        frontier = self.open_frontier(restart=True)
+        frontier.add_words({"new": 1}, "https://b.com/1")
+        frontier.pickle_fields(force=True)
+        frontier.close_save()
+
+        frontier = self.open_frontier(restart=False)
+        self.assertEqual(frontier.get_simhashes(), {})
+        self.assertEqual(frontier.word_count, {"new": 1})
+
+    def test_load_results(self):
+        frontier = self.open_frontier(restart=True)
+        completed_url = self.fill(frontier)
+        frontier.pickle_fields(force=True, compact=True)
+        frontier.add_words({"exile": 1}, "https://a.com/2")
+        frontier.pickle_fields(force=True)
+        frontier.close_save()
+
+        # the words counted after the compaction are only in the log
+        results = load_results()
+        self.assertEqual(results["completed_urls"], {completed_url})
+        self.assertEqual(results["subdomains"], {"a.com": {"https://a.com/1", "https://a.com/2"}})
+        self.assertEqual(results["word_count"], {"exile": 4, "path": 2})
+        self.assertEqual(results["max_words"], (completed_url, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from configparser import ConfigParser
+from unittest.mock import patch
+from crawler.frontier import Frontier
+from crawler.robot_parser import CustomRobotsParser
+from utils.config import Config
+
+
+class TestFrontierSave(unittest.TestCase):
+
+    def setUp(self):
+        cparser = ConfigParser()
+        cparser.read("config.ini")
+        config = Config(cparser)
+        config.seed_urls = []
+        config.time_delay = 0
+        self.config = config
+
+        # the frontier keeps its save file and backups in the working directory
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+
+        patcher = patch("crawler.frontier.Frontier.download_robots_txt_parser_for_domain",
+                        new=lambda frontier, domain: CustomRobotsParser(config.user_agent))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open_frontier(self, restart):
+        frontier = Frontier(self.config, restart)
+        self.addCleanup(frontier.close_save)
+        return frontier
+
+    def saved_rows(self):
+        """
+        Count the rows committed to the save file, read through a separate connection.
+        """
+        save = sqlite3.connect(os.path.join("backup_datastructures", self.config.save_file))
+        try:
+            return save.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        finally:
+            save.close()
+
+    def wait_for_rows(self, count, timeout=2):
+        deadline = time.time() + timeout
+        while self.saved_rows() < count and time.time() < deadline:
+            time.sleep(0.02)
+        return self.saved_rows()
+
+    def test_writer_commits_after_flush_ops(self):
+        self.config.save_flush_ops = 5
+        self.config.save_flush_interval = 60
+        frontier = self.open_frontier(restart=True)
+
+        frontier.add_urls([f"https://a.com/{i}" for i in range(4)], 0)
+        time.sleep(0.2)
+        self.assertEqual(self.saved_rows(), 0)
+        frontier.add_url("https://a.com/4", 0)
+        self.assertEqual(self.wait_for_rows(5), 5)
+
+    def test_writer_commits_after_flush_interval(self):
+        self.config.save_flush_ops = 1000
+        self.config.save_flush_interval = 0.3
+        frontier = self.open_frontier(restart=True)
+
+        frontier.add_url("https://a.com/0", 0)
+        self.assertEqual(self.saved_rows(), 0)
+        self.assertEqual(self.wait_for_rows(1), 1)
+
+    def test_close_flushes_queued_writes(self):
+        self.config.save_flush_ops = 1000
+        self.config.save_flush_interval = 60
+        frontier = self.open_frontier(restart=True)
+
+        frontier.add_urls([f"https://a.com/{i}" for i in range(3)], 0)
+        frontier.close_save()
+        self.assertEqual(self.saved_rows(), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from configparser import ConfigParser
+from unittest.mock import patch
+from crawler.frontier import Frontier
+from crawler.robot_parser import CustomRobotsParser
+from utils.config import Config
+
+
+class TestFrontierScheduler(unittest.TestCase):
+
+    def setUp(self):
+        cparser = ConfigParser()
+        cparser.read("config.ini")
+        config = Config(cparser)
+        config.seed_urls = []
+        config.time_delay = 0.2
+        self.config = config
+
+        # the frontier keeps its save file and backups in the working directory
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+
+        # every robots.txt allows everything, unless a test says otherwise
+        self.robots = lambda domain: CustomRobotsParser(config.user_agent)
+        patcher = patch("crawler.frontier.Frontier.download_robots_txt_parser_for_domain",
+                        new=lambda frontier, domain: self.robots(domain))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.frontier = Frontier(self.config, restart=True)
+        self.addCleanup(self.frontier.close_save)
+
+    def take_in_thread(self):
+        """
+        Call get_tbd_url on a new thread, returning the thread and a list its result is put in.
+        """
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.frontier.get_tbd_url()), daemon=True)
+        thread.start()
+        return thread, result
+
+    def test_empty_frontier_stops(self):
+        self.assertEqual(self.frontier.get_tbd_url(), (None, None))
+
+    def test_waits_for_urls_in_flight(self):
+        self.frontier.add_url("https://a.com/1", 0)
+        url, depth = self.frontier.get_tbd_url()
+        self.assertEqual((url, depth), ("https://a.com/1", 0))
+
+        # nothing is queued, but the url in flight may still add more
+        thread, result = self.take_in_thread()
+        thread.join(0.3)
+        self.assertTrue(thread.is_alive())
+
+        self.frontier.add_url("https://b.com/2", 1)
+        self.frontier.mark_url_complete(url, depth)
+        thread.join(2)
+        self.assertEqual(result, [("https://b.com/2", 1)])
+
+        # the last url in flight completing wakes every waiting worker
+        thread, result = self.take_in_thread()
+        self.frontier.mark_url_complete("https://b.com/2", 1)
+        thread.join(2)
+        self.assertEqual(result, [(None, None)])
+
+    def test_released_url_ends_the_wait(self):
+        self.frontier.add_url("https://a.com/1", 0)
+        url, _ = self.frontier.get_tbd_url()
+        thread, result = self.take_in_thread()
+        thread.join(0.3)
+        self.assertTrue(thread.is_alive())
+
+        self.frontier.release_url(url)
+        thread.join(2)
+        self.assertEqual(result, [(None, None)])
+        self.assertEqual(self.frontier._in_flight, 0)
+
+    def test_domain_delay_ordering(self):
+        self.frontier.add_urls([f"https://a.com/{i}" for i in range(3)], 0)
+        self.frontier.add_urls(["https://b.com/0"], 0)
+
+        handed_out = []
+        while True:
+            url, depth = self.frontier.get_tbd_url()
+            if url is None:
+                break
+            handed_out.append((url, time.time()))
+            self.frontier.mark_url_complete(url, depth)
+
+        self.assertEqual(sorted(url for url, _ in handed_out),
+                         ["https://a.com/0", "https://a.com/1", "https://a.com/2", "https://b.com/0"])
+        # each domain's urls come out in the order they were added
+        a_times = [at for url, at in handed_out if url.startswith("https://a.com/")]
+        self.assertEqual([url for url, _ in handed_out if url.startswith("https://a.com/")],
+                         ["https://a.com/0", "https://a.com/1", "https://a.com/2"])
+        # requests to a domain are at least the politeness delay apart
+        for earlier, later in zip(a_times, a_times[1:]):
+            self.assertGreaterEqual(later - earlier, self.config.time_delay - 0.01)
+        # another domain does not wait behind them
+        b_time = next(at for url, at in handed_out if url == "https://b.com/0")
+        self.assertLess(b_time - a_times[0], self.config.time_delay)
+
+
+    def test_urls_wait_while_robots_txt_is_unavailable(self):
+        fetches = []
+
+        def robots(domain):
+            fetches.append(domain)
+            if len(fetches) == 1:
+                return None
+            parser = CustomRobotsParser(self.config.user_agent)
+            parser.parse("User-agent: *\nDisallow: /private\n")
+            return parser
+        self.robots = robots
+        self.frontier.robots_negative_ttl = 0.2
+
+        self.frontier.add_urls(["https://a.com/private/1", "https://a.com/2"], 0)
+        # kept, not dropped as disallowed
+        self.assertEqual(len(self.frontier._url_index), 2)
+
+        started = time.time()
+        url, depth = self.frontier.get_tbd_url()
+        self.assertGreaterEqual(time.time() - started, 0.15)
+        self.assertEqual(url, "https://a.com/2")
+        self.assertEqual(len(fetches), 2)
+        self.frontier.mark_url_complete(url, depth)
+        # the url robots.txt disallows is skipped once it is known
+        self.assertEqual(self.frontier.get_tbd_url(), (None, None))
+
+    def test_gives_up_on_a_domain_whose_robots_txt_keeps_failing(self):
+        fetches = []
+
+        def robots(domain):
+            fetches.append(domain)
+            return None
+        self.robots = robots
+        self.frontier.robots_negative_ttl = 0.1
+        self.frontier.robots_max_failures = 2
+
+        self.frontier.add_urls([f"https://a.com/{i}" for i in range(5)], 0)
+        started = time.time()
+        self.assertEqual(self.frontier.get_tbd_url(), (None, None))
+        # the whole domain is dropped at once, not one url per negative TTL
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(len(fetches), 2)
+        self.assertEqual(self.frontier._in_flight, 0)
+        self.assertNotIn("a.com", self.frontier.domains_to_scrape)
+        # left incomplete for the next run
+        self.assertFalse(any(self.frontier._completed))
+
+    def test_expired_robots_txt_after_close(self):
+        self.frontier.add_url("https://a.com/1", 0)
+        parser, _ = self.frontier.robots_parsers["a.com"]
+        self.frontier.close_save()
+        self.frontier.robots_parsers["a.com"] = (parser, 0)
+
+        # the executor is shut down, the stale parser is served without a refetch
+        self.assertIs(self.frontier.get_robots_txt_parser("a.com"), parser)
+        self.assertEqual(self.frontier._robots_in_flight, {})
+        self.assertIs(self.frontier.get_robots_txt_parser("a.com"), parser)
+        self.frontier.add_urls(["https://b.com/1", "https://c.com/1"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import pickle
+import unittest
+from unittest import mock
+from crawler.robot_parser import CustomRobotsParser
+
+
+class TestCustomRobotsParser(unittest.TestCase):
+
+    def setUp(self):
+        robots_txt_content = """User-agent: *
+        Disallow: /wp-admin/
+        Allow: /wp-admin/admin-ajax.php
+        Disallow: /private
+
+        User-agent: OtherBot
+        Disallow: /
+
+        Sitemap: https://www.stat.uci.edu/wp-sitemap.xml"""
+        self.parser = CustomRobotsParser('POEWIKI_SCRAPER_USERAGENT')
+        self.parser.parse(robots_txt_content)
+
+    def test_can_fetch(self):
+        self.assertTrue(self.parser.can_fetch('/'))
+        self.assertTrue(self.parser.can_fetch(''))
+        self.assertTrue(self.parser.can_fetch('/wiki/Page'))
+        self.assertFalse(self.parser.can_fetch('/wp-admin/'))
+        self.assertFalse(self.parser.can_fetch('/wp-admin/options.php'))
+        self.assertTrue(self.parser.can_fetch('/wp-admin/admin-ajax.php'))
+        self.assertFalse(self.parser.can_fetch('/private/page'))
+
+    def test_user_agent_group(self):
+        parser = CustomRobotsParser('OtherBot')
+        parser.parse("User-agent: *\nDisallow: /a\n\nUser-agent: x\nUser-agent: otherbot\nDisallow: /b\n")
+        self.assertTrue(parser.can_fetch('/a'))
+        self.assertFalse(parser.can_fetch('/b'))
+
+    def test_user_agent_product_token(self):
+        content = "User-agent: *\nDisallow: /a\n\nUser-agent: bot\nUser-agent:\nDisallow: /b\n"
+        # 'bot' is part of the name, not the product token
+        parser = CustomRobotsParser('OtherBot')
+        parser.parse(content)
+        self.assertFalse(parser.can_fetch('/a'))
+        self.assertTrue(parser.can_fetch('/b'))
+        # the version after '/' is ignored on both sides
+        parser = CustomRobotsParser('Bot/2.1')
+        parser.parse(content.replace("User-agent: bot", "User-agent: BOT/1.0"))
+        self.assertTrue(parser.can_fetch('/a'))
+        self.assertFalse(parser.can_fetch('/b'))
+
+    def test_longest_match_wins(self):
+        parser = CustomRobotsParser()
+        parser.parse("User-agent: *\nAllow: /wiki\nDisallow: /wiki/Special:\n")
+        self.assertTrue(parser.can_fetch('/wiki/Page'))
+        self.assertFalse(parser.can_fetch('/wiki/Special:Search'))
+
+    def test_rule_tails(self):
+        parser = CustomRobotsParser()
+        parser.parse("User-agent: *\nDisallow: /archive/2019/\nDisallow: /archive/2020/old\nAllow: /archive/2020/old/keep\n")
+        self.assertFalse(parser.can_fetch('/archive/2019/page'))
+        self.assertTrue(parser.can_fetch('/archive/2019'))
+        self.assertTrue(parser.can_fetch('/archive/2020/ol'))
+        self.assertFalse(parser.can_fetch('/archive/2020/older'))
+        self.assertTrue(parser.can_fetch('/archive/2020/old/keep/1'))
+        self.assertTrue(parser.can_fetch('/archive/2021/'))
+
+    def test_crawl_delay(self):
+        self.assertIsNone(self.parser.crawl_delay)
+        parser = CustomRobotsParser('OtherBot')
+        parser.parse("User-agent: *\nCrawl-delay: 10\n\nUser-agent: otherbot\nCrawl-delay: 2.5\nDisallow: /b\n")
+        self.assertEqual(parser.crawl_delay, 2.5)
+        parser = CustomRobotsParser()
+        parser.parse("User-agent: *\nCrawl-delay: soon\n")
+        self.assertIsNone(parser.crawl_delay)
+
+    def test_parse_bytes(self):
+        parser = CustomRobotsParser()
+        parser.parse(b"User-agent: *\r\nDisallow: /a\r\nSitemap: https://x/s.xml\r\n")
+        self.assertFalse(parser.can_fetch('/a'))
+        self.assertTrue(parser.can_fetch('/b'))
+        self.assertEqual(parser.get_sitemaps(), ['https://x/s.xml'])
+
+    def test_parse_bytes_matches_str(self):
+        content = "User-agent: *\nDisallow: /caf\u00e9 # comment\nAllow: /a\n"
+        from_bytes = CustomRobotsParser()
+        from_bytes.parse(content.encode('utf-8'))
+        from_str = CustomRobotsParser()
+        from_str.parse(content)
+        self.assertEqual(from_bytes.disallowed, ['/caf\u00e9'])
+        self.assertEqual((from_bytes.allowed, from_bytes.disallowed),
+                         (from_str.allowed, from_str.disallowed))
+
+    def test_cached_decisions(self):
+        for _ in range(2):
+            self.assertFalse(self.parser.can_fetch('/wp-admin/options.php'))
+            self.assertTrue(self.parser.can_fetch('/wp-admin/admin-ajax.php'))
+        self.assertEqual(self.parser._decisions,
+                         {'/wp-admin/options.php': False, '/wp-admin/admin-ajax.php': True})
+
+    def test_no_rules_allows_without_caching(self):
+        parser = CustomRobotsParser()
+        parser.parse("User-agent: *\nDisallow:\nSitemap: https://x/s.xml\n")
+        self.assertTrue(parser.can_fetch('/anything'))
+        self.assertEqual(parser._decisions, {})
+
+    def test_cached_decisions_evict_oldest(self):
+        with mock.patch('crawler.robot_parser._DECISIONS_MAX', 2):
+            self.parser.can_fetch('/a')
+            self.parser.can_fetch('/b')
+            self.parser.can_fetch('/private/c')
+        self.assertEqual(list(self.parser._decisions), ['/b', '/private/c'])
+        self.assertFalse(self.parser.can_fetch('/private/c'))
+
+    def test_pickle_keeps_rules_only(self):
+        self.parser.can_fetch('/private/page')
+        state = self.parser.__getstate__()
+        self.assertIsNone(state['_trie'])
+        self.assertEqual(state['_decisions'], {})
+        restored = pickle.loads(pickle.dumps(self.parser))
+        self.assertFalse(restored.can_fetch('/private/page'))
+        self.assertTrue(restored.can_fetch('/wp-admin/admin-ajax.php'))
+
+    def test_get_sitemaps(self):
+        self.assertEqual(self.parser.get_sitemaps(),
+                         ['https://www.stat.uci.edu/wp-sitemap.xml'])
+
+
+if __name__ == '__main__':
+    unittest.main()
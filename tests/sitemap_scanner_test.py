@@ -0,0 +1,129 @@
+import gzip
+import io
+import os
+import tempfile
+import unittest
+from configparser import ConfigParser
+from unittest.mock import patch
+from lxml import etree
+from crawler import frontier as frontier_module
+from crawler.frontier import Frontier, _scan_sitemap_locs
+from crawler.robot_parser import CustomRobotsParser
+from utils.config import Config
+from utils.response import Response
+
+
+def lxml_locs(document):
+    """
+    Parse the <loc> values of a sitemap with lxml, as the reference for the scanner.
+    """
+    root = etree.fromstring(document)
+    return [loc.text.strip() for loc in root.iter("{*}loc") if loc.text and loc.text.strip()]
+
+
+def sitemap(locs, root="urlset", entry="url", prefix=""):
+    """
+    Build a sitemap document around raw <loc> contents.
+    """
+    ns = f"xmlns{':' + prefix[:-1] if prefix else ''}=\"http://www.sitemaps.org/schemas/sitemap/0.9\""
+    entries = "".join(f"<{prefix}{entry}>\n  <{prefix}loc>{loc}</{prefix}loc>\n"
+                      f"  <{prefix}lastmod>2024-01-01</{prefix}lastmod>\n</{prefix}{entry}>\n"
+                      for loc in locs)
+    return (f"<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<!-- generated -->\n"
+            f"<{prefix}{root} {ns}>\n{entries}</{prefix}{root}>\n").encode("utf-8")
+
+
+class TestSitemapScanner(unittest.TestCase):
+
+    locs = [
+        "https://a.com/",
+        "  https://a.com/padded  ",
+        "https://a.com/q?x=1&amp;y=2",
+        "https://a.com/entities?a=&lt;b&gt;&amp;c=&#39;d&#39;",
+        "https://a.com/café",
+        "<![CDATA[https://a.com/cdata?x=1&y=2]]>",
+        "<![CDATA[ https://a.com/cdata-amp?x=1&amp;y ]]>",
+        "\n    https://a.com/multiline\n  ",
+    ] + [f"https://a.com/page/{i}?ref=sitemap&amp;n={i}" for i in range(500)]
+
+    def assert_matches_lxml(self, document):
+        expected = lxml_locs(document)
+        # unfinished <loc> elements at the end of a block are carried into the next one
+        for block_size in (1, 7, 64, 1000, 1 << 16):
+            with patch.object(frontier_module, "_SITEMAP_READ_BYTES", block_size):
+                self.assertEqual(list(_scan_sitemap_locs(io.BytesIO(document))), expected,
+                                 f"block size {block_size}")
+
+    def test_matches_lxml(self):
+        self.assert_matches_lxml(sitemap(self.locs))
+
+    def test_matches_lxml_for_sitemap_index(self):
+        self.assert_matches_lxml(sitemap(self.locs[:20], root="sitemapindex", entry="sitemap"))
+
+    def test_cdata_after_the_head(self):
+        # CDATA well past the first bytes the head check looks at
+        document = sitemap(self.locs[8:] + ["<![CDATA[https://a.com/late?x=1&y=2]]>"])
+        self.assertEqual(list(_scan_sitemap_locs(io.BytesIO(document)))[-1],
+                         "https://a.com/late?x=1&y=2")
+        self.assert_matches_lxml(document)
+
+    def test_invalid_utf8_is_skipped(self):
+        document = sitemap(["https://a.com/1", "https://a.com/2"]).replace(
+            b"https://a.com/1", b"https://a.com/\xff\xfe1")
+        self.assertEqual(list(_scan_sitemap_locs(io.BytesIO(document))), ["https://a.com/2"])
+
+
+class TestIterSitemap(unittest.TestCase):
+
+    def setUp(self):
+        cparser = ConfigParser()
+        cparser.read("config.ini")
+        config = Config(cparser)
+        config.seed_urls = []
+        config.time_delay = 0
+        self.config = config
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+
+        patcher = patch("crawler.frontier.Frontier.download_robots_txt_parser_for_domain",
+                        new=lambda frontier, domain: CustomRobotsParser(config.user_agent))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.documents = {}
+        patcher = patch("crawler.frontier.download", new=self.download)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.frontier = Frontier(self.config, restart=True)
+        self.addCleanup(self.frontier.close_save)
+
+    def download(self, url, config, logger=None, max_bytes=None, stream=False, session=None):
+        return Response({"url": url, "status": 200, "content": io.BytesIO(self.documents[url])})
+
+    def iter_sitemap(self, document):
+        self.documents["https://a.com/sitemap.xml"] = document
+        sitemaps = []
+        urls = list(self.frontier._iter_sitemap("https://a.com/sitemap.xml", sitemaps))
+        return urls, sitemaps
+
+    def test_scanner_and_lxml_agree(self):
+        locs = TestSitemapScanner.locs
+        scanned = self.iter_sitemap(sitemap(locs))
+        # a namespace prefix sends the sitemap through lxml's iterparse
+        parsed = self.iter_sitemap(sitemap(locs, prefix="sm:"))
+        self.assertEqual(scanned, parsed)
+        self.assertEqual(len(scanned[0]), len(locs))
+
+    def test_gzipped_sitemap_index(self):
+        locs = ["https://a.com/s1.xml", "https://a.com/s2.xml?part=1&amp;of=2"]
+        urls, sitemaps = self.iter_sitemap(gzip.compress(sitemap(locs, root="sitemapindex", entry="sitemap")))
+        self.assertEqual(urls, [])
+        self.assertEqual(sitemaps, ["https://a.com/s1.xml", "https://a.com/s2.xml?part=1&of=2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 import os
 import logging
+from functools import lru_cache
 from hashlib import sha256
 from urllib.parse import urlparse
 
@@ -32,9 +33,12 @@ def get_logger(name, filename=None):
     return logger
 
 
+@lru_cache(maxsize=262144)
 def get_urlhash(url):
     """
     Generate a hash of the given URL.
+
+    Results are memoized, since the same links are rediscovered on many pages.
     
     Args:
         url (str): The URL to be hashed.
@@ -49,6 +53,7 @@ def get_urlhash(url):
         f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
         f"{parsed.query}".encode("utf-8")).hexdigest()
 
+@lru_cache(maxsize=262144)
 def normalize(url):
     """
     Normalize the given URL by removing a trailing forward slash, if present.
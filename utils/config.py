@@ -9,10 +9,13 @@ class Config(object):
         user_agent (str): The user agent string for the crawler.
         threads_count (int): The number of worker threads.
         save_file (str): The filename for saving the crawler state.
+        save_flush_ops (int): Queued save file writes committed together.
+        save_flush_interval (float): Seconds after which queued save file writes are committed anyway.
         host (str): The host for the cache server.
         port (int): The port number for the cache server.
         seed_urls (list): The list of seed URLs for the crawler.
         time_delay (float): The politeness time delay between requests.
+        robots_ttl (float): Seconds a cached robots.txt stays valid before it is refetched.
         cache_server (str): The cache server address (host and port).
     """
     def __init__(self, config):
@@ -22,11 +25,14 @@ class Config(object):
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.save_flush_ops = int(config["LOCAL PROPERTIES"].get("SAVEFLUSHOPS", 500))
+        self.save_flush_interval = float(config["LOCAL PROPERTIES"].get("SAVEFLUSHINTERVAL", 1))
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        self.robots_ttl = float(config["CRAWLER"].get("ROBOTSTTL", 21600))
 
         self.cache_server = None
\ No newline at end of file
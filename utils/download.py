@@ -1,10 +1,11 @@
 import requests
+import urllib3
 
 from utils.response import Response
 import requests
 
 
-def download(url, config, logger=None):
+def download(url, config, logger=None, max_bytes=None, stream=False, session=None):
     """
     Download the content of the given URL from the internet.
 
@@ -12,6 +13,13 @@ def download(url, config, logger=None):
         url (str): The URL to download.
         config (Config): A Config object containing the crawler configuration.
         logger (logging.Logger, optional): The logger to use for error messages. Defaults to None.
+        max_bytes (int, optional): Stream the body and stop reading after this many bytes,
+            cutting it back to the last complete line. Defaults to None (read everything).
+        stream (bool, optional): Leave the body unread and return it as a file-like object in
+            raw_response, for parsers that read incrementally. The caller must close it.
+            Defaults to False.
+        session (requests.Session, optional): Session to send the request with, reusing its
+            open connections to the host. Defaults to None (a new connection per request).
 
     Returns:
         Response: A Response object containing the downloaded content and metadata.
@@ -21,20 +29,42 @@ def download(url, config, logger=None):
         "User-Agent": config.user_agent
     }
 
+    resp = None
     try:
-        resp = requests.get(url, headers=headers)
+        resp = (session or requests).get(url, headers=headers, stream=stream or max_bytes is not None)
         resp.raise_for_status()  # Raise an exception for non-2xx status codes
 
-        if resp.content:
-            return Response({"content": resp.content, "url": url, "status": resp.status_code})
+        if stream:
+            resp.raw.decode_content = True  # undo gzip/deflate while reading
+            return Response({"content": resp.raw, "url": url, "status": resp.status_code})
+        elif max_bytes is None:
+            content = resp.content
+        else:
+            try:
+                content = resp.raw.read(max_bytes + 1, decode_content=True)
+            finally:
+                resp.close()
+            if len(content) > max_bytes:
+                content = content[:max_bytes]
+                content = content[:content.rfind(b"\n") + 1]
+                if logger:
+                    logger.info(f"Truncated {url} to {len(content)} bytes.")
 
-    except requests.exceptions.RequestException as e:
+        if content:
+            return Response({"content": content, "url": url, "status": resp.status_code})
+
+    # reading resp.raw directly skips requests' wrapping of urllib3's errors,
+    # such as a connection dropped partway through the body
+    except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+        if resp is not None:
+            # a streamed body is never read, close it to give the connection back to the pool
+            resp.close()
         if logger:
             logger.error(f"Error downloading {url}: {e}")
 
         return Response({
             "error": str(e),
-            "status": resp.status_code if hasattr(resp, "status_code") else None,
+            "status": getattr(resp, "status_code", None),
             "url": url
         })
 
@@ -43,6 +73,6 @@ def download(url, config, logger=None):
 
     return Response({
         "error": f"Spacetime Response error {resp} with url {url}.",
-        "status": resp.status_code if hasattr(resp, "status_code") else None,
+        "status": getattr(resp, "status_code", None),
         "url": url
     })
\ No newline at end of file